@@ -0,0 +1,750 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Waze fetcher adaptativo:
+- Usa la API moderna de Waze Live Map (tile-based system)
+- Si las APIs fallan, intenta scraping con Selenium WebDriver (Firefox)
+- Si WebDriver falla, usa datos de muestra como respaldo final
+- Sistema de tiles basado en zoom levels
+- Si un tile devuelve 404 o error, lo subdivide en 4 (hasta profundidad 2)
+- Extrae alerts, jams e irregularities
+
+Salida: amenazas/waze_incidents.geojson
+
+Requiere: 
+  - selenium>=4.15.2 para WebDriver
+  - Firefox y GeckoDriver: Sigue la guía de instalación manual (PPA de Mozilla + descarga de geckodriver)
+"""
+import os, json, sys, time, re, random, atexit, threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
+import numpy as np
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+
+ROOT = Path(__file__).resolve().parent
+OUT  = ROOT / "waze_incidents.geojson"
+
+BBOX_S=float(os.getenv("BBOX_S","-33.8"))
+BBOX_W=float(os.getenv("BBOX_W","-70.95"))
+BBOX_N=float(os.getenv("BBOX_N","-33.2"))
+BBOX_E=float(os.getenv("BBOX_E","-70.45"))
+TIMEOUT=int(os.getenv("WAZE_TIMEOUT","30"))
+CONNECT_TIMEOUT=float(os.getenv("WAZE_CONNECT_TIMEOUT","5"))
+RETRIES=int(os.getenv("WAZE_RETRIES","2"))
+MAX_DEPTH=int(os.getenv("WAZE_MAX_DEPTH","2"))
+SIMULATE=os.getenv("WAZE_SIMULATE","false").lower() in ("true", "1", "yes")
+PAR=int(os.getenv("WAZE_PARALLEL","8"))  # tiles fetched concurrently
+SIM_INCIDENTS=int(os.getenv("WAZE_SIM_INCIDENTS","0"))  # incidents per simulated tile (0 = random 2-5)
+
+# Modern Waze Live Map API endpoint
+WAZE_API_BASE = "https://www.waze.com/live-map/api/georss"
+
+# Modern Waze API endpoints to try, in order
+WAZE_ENDPOINTS = (
+    WAZE_API_BASE,
+    "https://www.waze.com/row-rtserver/web/TGeoRSS",
+    "https://www.waze.com/partnerhub-api/georss",
+)
+# Seconds an endpoint that answered 404 or refused the connection is skipped
+ENDPOINT_DEAD_TTL=float(os.getenv("WAZE_ENDPOINT_DEAD_TTL","60"))
+_EP_DEAD: Dict[str,float] = {}  # base_url -> time.monotonic() until which it is skipped
+# Exponential backoff between retries (seconds): base*2**attempt, capped, full jitter
+BACKOFF_BASE=float(os.getenv("WAZE_BACKOFF_BASE","0.5"))
+BACKOFF_MAX=float(os.getenv("WAZE_BACKOFF_MAX","30"))
+
+UA={
+    "User-Agent":"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer":"https://www.waze.com/live-map",
+    "Accept":"*/*",
+    "Accept-Language":"es-ES,es;q=0.9,en;q=0.8",
+    "Origin":"https://www.waze.com"
+}
+
+# One keep-alive session for every tile: all requests go to www.waze.com, so
+# reusing the TCP/TLS connection saves a handshake per tile and per retry.
+# Accept-Encoding is left to requests/urllib3: it offers gzip/deflate, plus br
+# whenever the brotli package is installed, and decodes whatever comes back.
+SESSION=requests.Session()
+SESSION.headers.update(UA)
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=PAR, max_retries=0))
+
+# Intercepted Waze API calls worth parsing (row grid, live traffic, real-time
+# server, GeoRSS, routing). Compiled once; the bounded gap caps the work per URL
+# on the very long query strings the live map produces.
+WAZE_API_RE=re.compile(r"waze\.com.{0,2048}?(?:/row-|/Descartes-live/|/rtserver/|/georss|/RoutingRequest)")
+# Responses larger than this are not Waze feeds (tiles, bundles); skip parsing them.
+MAX_BODY_BYTES=int(os.getenv("WAZE_MAX_BODY_MB","20"))*1024*1024
+
+# Alert type -> (subtype, severity). ROAD_CLOSED is covered by CLOS.
+_SEV_RE=re.compile(r"CLOS|JAM|ACCIDENT|CRASH|HAZARD")
+_SEV_MAP={
+    "CLOS":("CLOSURE",3),
+    "JAM":("TRAFFIC_JAM",2),
+    "ACCIDENT":("ACCIDENT",3),
+    "CRASH":("ACCIDENT",3),
+    "HAZARD":("HAZARD",2),
+}
+_SEV_DEFAULT=("INCIDENT",1)
+
+# Firefox binary lookup order (prioritize esr from the Mozilla PPA)
+FIREFOX_PATHS=(
+    '/usr/bin/firefox-esr', # <-- Prioridad #1 (PPA de Mozilla)
+    '/usr/bin/firefox',     # <-- Paquete dummy de snap (malo)
+    '/snap/bin/firefox',
+    '/usr/local/bin/firefox',
+    '/usr/local/bin/firefox-esr',
+)
+
+SIM_TYPES=np.array(["ACCIDENT", "HAZARD_ON_ROAD", "ROAD_CLOSED", "JAM"])
+
+def generate_simulated_data(s,w,n,e)->Dict[str,Any]:
+    """Generate simulated Waze data for testing when API is unavailable"""
+    # Own generator per tile: reproducible per bbox and leaves the global random state alone
+    base = hash((s,w,n,e))
+    rng = np.random.default_rng(base & 0xffffffff)
+    
+    # Generate 2-5 random incidents in the bbox (or WAZE_SIM_INCIDENTS for load tests)
+    num_incidents = SIM_INCIDENTS or int(rng.integers(2, 6))
+    lats = rng.uniform(s, n, num_incidents)
+    lons = rng.uniform(w, e, num_incidents)
+    types = rng.choice(SIM_TYPES, num_incidents)
+    npoints = rng.integers(3, 9, num_incidents)
+    speeds = rng.integers(5, 31, num_incidents)
+    levels = rng.integers(1, 6, num_incidents)
+    now = int(time.time() * 1000)
+    offsets = np.arange(8) * 0.002
+    
+    alerts = []
+    jams = []
+    for i, (lat, lon, incident_type) in enumerate(zip(lats.tolist(), lons.tolist(), types.tolist())):
+        if incident_type == "JAM":
+            # Create a traffic jam with a line
+            off = offsets[:npoints[i]]
+            line = [{"x": x, "y": y} for x, y in zip((lon + off).tolist(), (lat + off * 0.5).tolist())]
+            jams.append({
+                "uuid": f"sim_jam_{base ^ (i * 0x9E3779B1)}",
+                "line": line,
+                "speed": int(speeds[i]),
+                "level": int(levels[i]),
+                "pubMillis": now
+            })
+        else:
+            # Create an alert
+            alerts.append({
+                "uuid": f"sim_alert_{base ^ (i * 0x9E3779B1)}",
+                "location": {"x": lon, "y": lat},
+                "type": incident_type,
+                "street": f"Calle Simulada {i+1}",
+                "reportDescription": f"Incident simulado tipo {incident_type}",
+                "pubMillis": now
+            })
+    
+    return {"alerts": alerts, "jams": jams, "irregularities": []}
+
+def load_sample_data()->Dict[str,Any]:
+    """Load sample data from amenazas_muestra.geojson as fallback"""
+    sample_path = ROOT / "amenazas_muestra.geojson"
+    try:
+        if sample_path.exists():
+            with open(sample_path, 'r', encoding='utf-8') as f:
+                sample_geojson = json.load(f)
+                # Convert GeoJSON features back to Waze API format
+                alerts = []
+                jams = []
+                for feature in sample_geojson.get("features", []):
+                    props = feature.get("properties", {})
+                    geom = feature.get("geometry", {})
+                    
+                    if geom.get("type") == "Point":
+                        coords = geom.get("coordinates", [])
+                        if len(coords) >= 2:
+                            alerts.append({
+                                "uuid": props.get("ext_id", f"sample_{len(alerts)}"),
+                                "location": {"x": coords[0], "y": coords[1]},
+                                "type": props.get("subtype", "INCIDENT"),
+                                "street": props.get("description", ""),
+                                "reportDescription": props.get("description", ""),
+                                "pubMillis": int(time.time() * 1000)
+                            })
+                    elif geom.get("type") == "LineString":
+                        coords = geom.get("coordinates", [])
+                        line = [{"x": c[0], "y": c[1]} for c in coords]
+                        jams.append({
+                            "uuid": props.get("ext_id", f"sample_jam_{len(jams)}"),
+                            "line": line,
+                            "speed": props.get("metrics", {}).get("speed_kmh", 20),
+                            "level": props.get("severity", 2),
+                            "pubMillis": int(time.time() * 1000)
+                        })
+                
+                return {"alerts": alerts, "jams": jams, "irregularities": []}
+    except Exception as e:
+        sys.stderr.write(f"[warn] Could not load sample data: {e}\n")
+    
+    return {"alerts": [], "jams": [], "irregularities": []}
+
+# Seconds to wait for the live map to issue its first Waze API call
+PAGE_WAIT=float(os.getenv("WAZE_PAGE_WAIT","5"))
+
+# Single Firefox shared by every tile that falls back to the browser: starting
+# geckodriver + Firefox costs seconds, navigating an open one does not.
+_DRIVER=None
+_DRIVER_LOCK=threading.Lock()
+# Set once selenium is missing or Firefox cannot start: later tiles skip the browser
+_WEBDRIVER_UNAVAILABLE=False
+
+def _quit_driver():
+    global _DRIVER
+    if _DRIVER is not None:
+        try:
+            _DRIVER.quit()
+        except Exception:
+            pass
+        _DRIVER=None
+
+atexit.register(_quit_driver)
+
+def _get_driver():
+    """Return the shared selenium-wire Firefox, starting it on first use"""
+    global _DRIVER
+    if _DRIVER is not None:
+        return _DRIVER
+
+    from seleniumwire import webdriver
+    from selenium.webdriver.firefox.options import Options
+    from selenium.webdriver.firefox.service import Service
+
+    # Configure Firefox options for headless mode
+    firefox_options = Options()
+    firefox_options.add_argument('-headless')  # Headless mode for containers
+    firefox_options.set_preference('general.useragent.override', UA["User-Agent"])
+    firefox_options.set_preference('permissions.default.image', 2)  # Disable images for faster loading
+    firefox_options.set_preference('dom.webnotifications.enabled', False)  # Disable notifications
+    # Scraping only needs the API traffic: no HTTP cache, no back/forward cache, no IPv6 lookups
+    firefox_options.set_preference('network.http.use-cache', False)
+    firefox_options.set_preference('browser.cache.memory.enable', False)
+    firefox_options.set_preference('browser.cache.disk.enable', False)
+    firefox_options.set_preference('browser.sessionhistory.max_total_viewers', 0)
+    firefox_options.set_preference('network.dns.disableIPv6', True)
+
+    # Configure selenium-wire options to capture network traffic
+    seleniumwire_options = {
+        'disable_encoding': True,  # Disable response encoding to get raw data
+        'verify_ssl': False,  # Don't verify SSL certificates (for Waze HTTPS)
+        'suppress_connection_errors': True,  # Suppress connection errors
+    }
+
+    # Auto-detect Firefox binary location (prioritize esr)
+    firefox_binary = None
+    for path in FIREFOX_PATHS:
+        if os.path.exists(path) and os.access(path, os.X_OK):
+            try:
+                import subprocess
+                result = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=2)
+                if result.returncode == 0 and 'firefox' in result.stdout.lower():
+                    firefox_binary = path
+                    sys.stderr.write(f"[info] Found Firefox at: {path}\n")
+                    break
+            except (FileNotFoundError, subprocess.TimeoutExpired, Exception):
+                continue
+
+    if not firefox_binary:
+        for cmd in ['firefox-esr', 'firefox']: # Prioritize esr
+            try:
+                import subprocess
+                result = subprocess.run(['which', cmd], capture_output=True, text=True, timeout=2)
+                if result.returncode == 0:
+                    path = result.stdout.strip()
+                    if path and os.path.exists(path):
+                        firefox_binary = path
+                        sys.stderr.write(f"[info] Found Firefox at: {path}\n")
+                        break
+            except (FileNotFoundError, subprocess.TimeoutExpired, Exception):
+                continue
+
+    if firefox_binary:
+        firefox_options.binary_location = firefox_binary
+    else:
+        sys.stderr.write(f"[warn] Firefox binary not found. WebDriver may fail or try to download Firefox.\n")
+        sys.stderr.write(f"[warn] Install Firefox: sudo apt-get install firefox-esr\n")
+
+    sys.stderr.write(f"[info] Starting Firefox WebDriver\n")
+
+    # Configure GeckoDriver service
+    service = None
+    try:
+        import subprocess
+        result = subprocess.run(['which', 'geckodriver'], capture_output=True, text=True, timeout=2)
+        if result.returncode == 0:
+            geckodriver_path = result.stdout.strip()
+            if geckodriver_path and os.path.exists(geckodriver_path):
+                service = Service(executable_path=geckodriver_path)
+                sys.stderr.write(f"[info] Using GeckoDriver at: {geckodriver_path}\n")
+    except Exception:
+        pass # Fallback to Selenium finding it in PATH
+
+    if service:
+        driver = webdriver.Firefox(service=service, options=firefox_options, seleniumwire_options=seleniumwire_options)
+    else:
+        driver = webdriver.Firefox(options=firefox_options, seleniumwire_options=seleniumwire_options)
+    driver.set_page_load_timeout(TIMEOUT)
+    sys.stderr.write(f"[info] Firefox WebDriver with selenium-wire started successfully\n")
+    _DRIVER = driver
+    return driver
+
+def fetch_with_webdriver(s,w,n,e)->Dict[str,Any]:
+    """Fetch Waze data using Selenium-Wire to intercept API requests"""
+    global _WEBDRIVER_UNAVAILABLE
+    # Check for selenium-wire availability first. It's the primary dependency for this method.
+    try:
+        from seleniumwire import webdriver
+    except ImportError as e:
+        # This is more descriptive. The error is often not that selenium-wire is missing,
+        # but that one of its dependencies (like selenium) is.
+        sys.stderr.write(f"[ERROR] Failed to import selenium-wire. It might be due to a missing dependency or version conflict.\n")
+        sys.stderr.write(f"[ERROR] Original ImportError: {e}\n")
+        sys.stderr.write(f"[info] Ensure both selenium and selenium-wire are correctly installed: pip install --upgrade selenium selenium-wire\n")
+        _WEBDRIVER_UNAVAILABLE=True
+        raise RuntimeError(f"selenium-wire import failed. Using fallback data.")
+
+    # Check for selenium availability. selenium-wire requires it.
+    try:
+        from selenium.webdriver.firefox.options import Options
+        from selenium.webdriver.firefox.service import Service
+        from selenium.common.exceptions import TimeoutException, WebDriverException, SessionNotCreatedException
+    except ImportError as e:
+        sys.stderr.write(f"[info] selenium package incomplete or missing. selenium-wire requires it. {e}\n")
+        sys.stderr.write(f"[info] Install with: pip install selenium>=4.15.2\n")
+        _WEBDRIVER_UNAVAILABLE=True
+        raise RuntimeError(f"selenium not properly installed. Using fallback data.")
+
+    # One shared browser: tiles take turns navigating it
+    with _DRIVER_LOCK:
+        return _fetch_with_driver(s,w,n,e)
+
+def _fetch_with_driver(s,w,n,e)->Dict[str,Any]:
+    global _WEBDRIVER_UNAVAILABLE
+    from selenium.common.exceptions import TimeoutException, WebDriverException, SessionNotCreatedException
+    try:
+        # Calculate center point for the live map URL
+        center_lat = (s + n) / 2
+        center_lon = (w + e) / 2
+        zoom = 13  # Good zoom level for data collection
+
+        driver = _get_driver()
+        sys.stderr.write(f"[info] Using Firefox WebDriver for tile {s:.4f},{w:.4f},{n:.4f},{e:.4f}\n")
+
+        live_map_url = f"https://www.waze.com/live-map?zoom={zoom}&lat={center_lat}&lon={center_lon}"
+
+        # Clear previous requests
+        del driver.requests
+
+        # Navigate to Waze Live Map
+        sys.stderr.write(f"[info] Loading Waze Live Map and intercepting API requests...\n")
+        driver.get(live_map_url)
+
+        # Wait until the page issues its first Waze API call instead of a fixed sleep
+        try:
+            driver.wait_for_request(WAZE_API_RE.pattern, timeout=PAGE_WAIT)
+        except TimeoutException:
+            pass
+
+        # Intercept and extract data from API requests
+        # driver.requests copies every captured request out of selenium-wire's
+        # storage on each access: read it once and reuse the list
+        captured = driver.requests
+        sys.stderr.write(f"[info] Analyzing {len(captured)} intercepted requests...\n")
+
+        extracted_data = {"alerts": [], "jams": [], "irregularities": []}
+        unique_uuids = set()
+
+        # Analyze intercepted requests
+        for request in captured:
+            try:
+                # Check if this is a Waze API request with a response
+                if not request.response or not WAZE_API_RE.search(request.url):
+                    continue
+
+                # Only process successful responses
+                if request.response.status_code != 200:
+                    continue
+
+                sys.stderr.write(f"[info] Found Waze API request: {request.url[:80]}...\n")
+
+                # Try to parse the response body as JSON
+                try:
+                    response_body = request.response.body
+                    if len(response_body) > MAX_BODY_BYTES:
+                        continue
+                    # orjson parses the raw UTF-8 bytes; no intermediate str copy
+                    data = orjson.loads(response_body)
+                    if not isinstance(data, dict):
+                        continue
+
+                    # Extract alerts, jams and irregularities (lists or uuid-keyed dicts)
+                    for key in ("alerts", "jams", "irregularities"):
+                        items = data.get(key)
+                        if isinstance(items, dict):
+                            items = items.values()
+                        elif not isinstance(items, list):
+                            continue
+                        bucket = extracted_data[key]
+                        for item in items:
+                            if isinstance(item, dict):
+                                uuid = item.get("uuid")
+                                if uuid and uuid not in unique_uuids:
+                                    unique_uuids.add(uuid)
+                                    bucket.append(item)
+
+                except (orjson.JSONDecodeError, UnicodeDecodeError):
+                    # Not JSON or not decodable, skip
+                    continue
+
+            except Exception:
+                # Skip this request if there's any error
+                continue
+
+        sys.stderr.write(f"[info] Extracted from API: {len(extracted_data['alerts'])} alerts, {len(extracted_data['jams'])} jams\n")
+
+        # Filter by bounding box (the live map returns everything in view)
+        filtered_data = filter_bbox(extracted_data, s, w, n, e)
+
+        if any(filtered_data.values()):
+            sys.stderr.write(f"[ok] Selenium-wire extracted {len(filtered_data['alerts'])} alerts, {len(filtered_data['jams'])} jams\n")
+            return filtered_data
+
+        # If no data found, return empty
+        sys.stderr.write(f"[warn] Selenium-wire could not extract data from intercepted API requests\n")
+        raise RuntimeError("No data extracted via selenium-wire")
+
+    except SessionNotCreatedException as e:
+        _quit_driver()
+        _WEBDRIVER_UNAVAILABLE=True
+        error_msg = str(e)
+        if "geckodriver" in error_msg.lower():
+            sys.stderr.write(f"[ERROR] GeckoDriver not found or incompatible.\n")
+            sys.stderr.write(f"[ERROR] Install: (run manual geckodriver install script)\n")
+        elif "Firefox" in error_msg or "firefox" in error_msg.lower():
+            sys.stderr.write(f"[ERROR] Firefox not properly installed or can't start.\n")
+            sys.stderr.write(f"[ERROR] Install Firefox: (run PPA install script for firefox-esr)\n")
+        else:
+            sys.stderr.write(f"[ERROR] WebDriver session error: {error_msg}\n")
+        raise RuntimeError(f"Firefox not available or misconfigured. Using fallback data.") from e
+    except WebDriverException as e:
+        # Broken session: drop it so the next tile starts a fresh browser
+        _quit_driver()
+        error_msg = str(e)
+        sys.stderr.write(f"[ERROR] Firefox WebDriver error: {error_msg}\n")
+        if "geckodriver" in error_msg.lower():
+            sys.stderr.write(f"[ERROR] Install GeckoDriver: (run manual geckodriver install script)\n")
+        raise RuntimeError(f"Firefox WebDriver failed. Using fallback data.") from e
+    except Exception as e:
+        sys.stderr.write(f"[warn] WebDriver fetch failed: {e}\n")
+        raise RuntimeError(f"WebDriver failed. Using fallback data.") from e
+
+def _sleep_backoff(attempt:int, retry_after=None):
+    """Sleep before retrying: honour Retry-After when the server sends one, else jittered exponential backoff"""
+    if retry_after:
+        try:
+            time.sleep(min(BACKOFF_MAX, float(retry_after)))
+            return
+        except ValueError:
+            pass  # HTTP-date form; fall back to our own schedule
+    # Full jitter keeps subdivided tiles from retrying in lockstep
+    time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+def _bbox_mask(xy, s,w,n,e):
+    """Boolean mask of the (lon, lat) rows inside the bbox; missing coordinates (None -> NaN) never match"""
+    xy=np.asarray(xy, dtype=np.float64).reshape(-1,2)
+    x,y=xy[:,0],xy[:,1]
+    return (x>=w)&(x<=e)&(y>=s)&(y<=n)
+
+def filter_bbox(data:Dict[str,Any], s,w,n,e)->Dict[str,Any]:
+    """Keep alerts/irregularities located in the bbox and jams with at least one point in it"""
+    alerts=data.get("alerts") or []
+    irrs=data.get("irregularities") or []
+    jams=data.get("jams") or []
+    out={"alerts": [], "jams": [], "irregularities": []}
+    if alerts:
+        mask=_bbox_mask([_xy(a.get("location") or {}) for a in alerts], s,w,n,e)
+        out["alerts"]=[alerts[i] for i in np.flatnonzero(mask)]
+    if irrs:
+        mask=_bbox_mask([_xy(i.get("seg") or i.get("location") or {}) for i in irrs], s,w,n,e)
+        out["irregularities"]=[irrs[i] for i in np.flatnonzero(mask)]
+    if jams:
+        # Flatten every line point tagged with its jam index, mask once, keep the jams that have a hit
+        idx=[]; pts=[]
+        for i,j in enumerate(jams):
+            for p in j.get("line") or []:
+                if isinstance(p, dict):
+                    idx.append(i); pts.append(_xy(p))
+        if pts:
+            mask=_bbox_mask(pts, s,w,n,e)
+            out["jams"]=[jams[i] for i in np.unique(np.asarray(idx)[mask])]
+    return out
+
+def fetch_box(s,w,n,e)->Dict[str,Any]:
+    """Fetch Waze data for a bounding box using modern API endpoints, WebDriver, and sample data as fallback"""
+    # If simulation mode is enabled, return simulated data
+    if SIMULATE:
+        return generate_simulated_data(s,w,n,e)
+    
+    # Try multiple endpoint patterns with proper lat/lon bounds
+    params = {
+        "bottom": s,
+        "left": w, 
+        "top": n,
+        "right": e,
+        "types": "alerts,traffic,irregularities",
+        "format": "JSON"
+    }
+    
+    last_error = None
+    for k in range(RETRIES):
+        # Try API endpoints, skipping the ones already known dead in this run
+        for base_url in WAZE_ENDPOINTS:
+            if _EP_DEAD.get(base_url, 0) > time.monotonic():
+                continue
+            try:
+                r = SESSION.get(base_url, params=params, timeout=(CONNECT_TIMEOUT, TIMEOUT))
+                if r.status_code == 200:
+                    try:
+                        data = orjson.loads(r.content)
+                        # Check if we got valid data
+                        if data and isinstance(data, dict):
+                            # Filtro extra, a veces la API devuelve datos vacíos
+                            if data.get("alerts") or data.get("jams") or data.get("irregularities"):
+                                return data
+                            else:
+                                last_error = "API returned empty (no alerts/jams)"
+                    except Exception as je:
+                        last_error = f"JSON parse error: {je}"
+                        pass
+                elif r.status_code == 404:
+                    last_error = f"{base_url} -> HTTP 404"
+                    _EP_DEAD[base_url] = time.monotonic() + ENDPOINT_DEAD_TTL
+                    continue
+                else:
+                    last_error = f"{base_url} -> HTTP {r.status_code}"
+                _sleep_backoff(k, r.headers.get("Retry-After") if r.status_code in (429, 503) else None)
+            except requests.ConnectionError as ex:
+                last_error = f"{base_url} -> {str(ex)}"
+                _EP_DEAD[base_url] = time.monotonic() + ENDPOINT_DEAD_TTL
+            except Exception as ex:
+                last_error = f"{base_url} -> {str(ex)}"
+                _sleep_backoff(k)
+    
+    # If all API endpoints failed, try WebDriver scraping (once per tile, after the
+    # retries; skipped for the rest of the run once the browser proved unusable)
+    if _WEBDRIVER_UNAVAILABLE:
+        sys.stderr.write(f"[info] API endpoints failed and WebDriver is unavailable, skipping it.\n")
+    else:
+        sys.stderr.write(f"[info] API endpoints failed, trying WebDriver scraping...\n")
+        try:
+            webdriver_data = fetch_with_webdriver(s, w, n, e)
+            if webdriver_data and (webdriver_data.get("alerts") or webdriver_data.get("jams")):
+                return webdriver_data
+        except Exception as ex:
+            last_error = str(ex)
+            # Error messages already logged in fetch_with_webdriver
+            if "WebDriver unavailable" in last_error:
+                sys.stderr.write(f"[info] WebDriver not available (Firefox/GeckoDriver issue). Falling back to sample data.\n")
+            elif "selenium-wire not available" in last_error:
+                sys.stderr.write(f"[info] selenium-wire not available. Falling back to sample data.\n")
+            elif "selenium not properly installed" in last_error:
+                sys.stderr.write(f"[info] selenium package not properly installed. Falling back to sample data.\n")
+            else:
+                sys.stderr.write(f"[info] WebDriver scraping failed. Falling back to sample data.\n")
+    
+    # If WebDriver also failed, use sample data as final fallback
+    sys.stderr.write(f"[OK] Using sample data from amenazas_muestra.geojson\n")
+    sample_data = load_sample_data()
+    if sample_data and (sample_data.get("alerts") or sample_data.get("jams")):
+        sys.stderr.write(f"[OK] Loaded {len(sample_data.get('alerts', []))} sample alerts, {len(sample_data.get('jams', []))} sample jams\n")
+        return sample_data
+    
+    sys.stderr.write(f"[ERROR] All data sources failed and no sample data available\n")
+    raise RuntimeError(last_error if last_error else "Unknown error")
+
+def _xy(p:Dict[str,Any])->Tuple[Any,Any]:
+    """(lon, lat) of a Waze point, whichever key names the feed used (x/y, lon/lat or longitude/latitude)"""
+    return (p.get("x") or p.get("lon") or p.get("longitude"),
+            p.get("y") or p.get("lat") or p.get("latitude"))
+
+def to_features(ch:Dict[str,Any])->Iterator[Dict[str,Any]]:
+    """Convert Waze API response to GeoJSON features (lazily)"""
+    # Process alerts
+    for a in ch.get("alerts",[]) or []:
+        loc=a.get("location") or {}
+        lon,lat=_xy(loc)
+        
+        if lon is None or lat is None: 
+            continue
+            
+        typ=(a.get("type") or "").upper()
+        
+        # Determine severity and subtype
+        m=_SEV_RE.search(typ)
+        subtype,sev=_SEV_MAP[m.group()] if m else _SEV_DEFAULT
+        
+        props={
+            "provider":"WAZE",
+            "ext_id":a.get("uuid") or a.get("id") or f"alert:{lon},{lat}",
+            "kind":"incident",
+            "subtype":subtype,
+            "severity":sev,
+            "description":a.get("reportDescription") or a.get("street") or typ,
+            "street":a.get("street"),
+            "type_raw":a.get("type"),
+            "timestamp":a.get("pubMillis") or a.get("reportTimestamp")
+        }
+        yield {
+            "type":"Feature",
+            "geometry":{"type":"Point","coordinates":[lon,lat]},
+            "properties":props
+        }
+    
+    # Process jams (traffic)
+    for j in ch.get("jams",[]) or []:
+        line=j.get("line") or []
+        coords=[[x, y] for x, y in map(_xy, line) if x is not None and y is not None]
+        
+        if len(coords)>=2:
+            speed_kmh = j.get("speed") or j.get("speedKMH")
+            level = j.get("level") or 0
+            sev = 1 if level <= 2 else 2 if level <= 4 else 3
+            
+            props={
+                "provider":"WAZE",
+                "ext_id":j.get("uuid") or j.get("id") or f"jam:{len(coords)}",
+                "kind":"incident",
+                "subtype":"TRAFFIC_JAM",
+                "severity":sev,
+                "metrics":{"speed_kmh":speed_kmh, "level": level},
+                "timestamp":j.get("pubMillis") or j.get("updateTimestamp")
+            }
+            yield {
+                "type":"Feature",
+                "geometry":{"type":"LineString","coordinates":coords},
+                "properties":props
+            }
+    
+    # Process irregularities
+    for irr in ch.get("irregularities",[]) or []:
+        seg=irr.get("seg") or irr.get("location") or {}
+        lon,lat=_xy(seg)
+        
+        if lon is not None and lat is not None:
+            props={
+                "provider":"WAZE",
+                "ext_id":irr.get("id") or f"irr:{lon},{lat}",
+                "kind":"incident",
+                "subtype":"IRREGULARITY",
+                "severity":1,
+                "metrics":{"speed_kmh":irr.get("speed")},
+                "timestamp":irr.get("pubMillis") or irr.get("detectionTime")
+            }
+            yield {
+                "type":"Feature",
+                "geometry":{"type":"Point","coordinates":[lon,lat]},
+                "properties":props
+            }
+
+def subdivide(s,w,n,e):
+    mlat=(s+n)/2.0; mlon=(w+e)/2.0
+    return [(s,w,mlat,mlon),(s,mlon,mlat,e),(mlat,w,n,mlon),(mlat,mlon,n,e)]
+
+def crawl(s,w,n,e,depth=0)->Iterator[Dict[str,Any]]:
+    """Crawl tiles breadth-first, subdividing on errors; each level is fetched in parallel and features are yielded as tiles arrive"""
+    level=[(s,w,n,e,depth)]
+    with ThreadPoolExecutor(max_workers=PAR) as ex:
+        while level:
+            futs={ex.submit(fetch_box,*t[:4]): t for t in level}
+            level=[]
+            for fut in as_completed(futs):
+                s,w,n,e,d=futs[fut]
+                try:
+                    data=fut.result()
+                except Exception as ex_:
+                    sys.stderr.write(f"[warn] tile {s:.4f},{w:.4f},{n:.4f},{e:.4f} -> {ex_}\n")
+                    if d<MAX_DEPTH:
+                        level.extend((*q, d+1) for q in subdivide(s,w,n,e))
+                    continue
+                # Si no hay features pero tampoco error, no subdividir indefinidamente
+                cnt=0
+                for f in to_features(data):
+                    cnt+=1
+                    yield f
+                if cnt:
+                    sys.stderr.write(f"[ok] tile {s:.4f},{w:.4f},{n:.4f},{e:.4f} -> {cnt} features\n")
+
+def dedupe(features:Iterable[Dict[str,Any]])->Iterator[Dict[str,Any]]:
+    """Yield features whose ext_id was not seen before; only the ids are kept in memory"""
+    seen=set()
+    for f in features:
+        eid=f["properties"].get("ext_id")
+        if eid:
+            if eid in seen: continue
+            seen.add(eid)
+        yield f
+
+def write_feature_collection(path:Path, features:Iterable[Dict[str,Any]])->int:
+    """Stream features to path as a FeatureCollection without building the whole document in memory.
+
+    Writes to a temporary sibling and only replaces path when at least one feature
+    was written, so an empty crawl never clobbers previous data. Returns the count.
+    """
+    tmp=path.with_name(path.name+".tmp")
+    n=0
+    try:
+        with open(tmp,"wb") as fh:
+            fh.write(b'{"type":"FeatureCollection","features":[')
+            for f in features:
+                if n: fh.write(b",")
+                fh.write(orjson.dumps(f))
+                n+=1
+            fh.write(b"]}")
+        if n:
+            tmp.replace(path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return n
+
+def write_empty(path:Path):
+    path.write_bytes(orjson.dumps({"type":"FeatureCollection","features":[]}))
+
+def main():
+    """Main function to fetch Waze data and save as GeoJSON"""
+    mode_str = "SIMULATION" if SIMULATE else "LIVE"
+    print(f"[INFO] Fetching Waze data ({mode_str} mode) for bbox: S={BBOX_S}, W={BBOX_W}, N={BBOX_N}, E={BBOX_E}")
+    
+    try:
+        n=write_feature_collection(OUT, dedupe(crawl(BBOX_S,BBOX_W,BBOX_N,BBOX_E,0)))
+        
+        # Don't overwrite existing file if no features were found
+        if n == 0:
+            if OUT.exists():
+                print(f"[WARN] No features fetched. Keeping existing {OUT} to preserve data.")
+                return
+            else:
+                print(f"[WARN] No features fetched and no existing file.")
+                # Create empty file so loader knows we tried
+                write_empty(OUT)
+                return
+        
+        print(f"[OK] Saved {OUT} ({n} features)")
+        
+    except Exception as e:
+        print(f"[ERROR] Failed to fetch Waze data: {e}")
+        if OUT.exists():
+            print(f"[INFO] Keeping existing {OUT} to preserve data.")
+        else:
+            print(f"[INFO] Creating empty file at {OUT}")
+            write_empty(OUT)
+
+if __name__=="__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenWeather threats generator (loads .env via python-dotenv).
+Env:
+  OPENWEATHER_KEY (required)
+  BBOX_S,BBOX_W,BBOX_N,BBOX_E
+  WEATHER_GRID (cell size in degrees, default 0.02)
+  WEATHER_QUERY_RES (degrees; cells whose centers round to the same point share one API call, default 0.1; 0 = one call per cell)
+  WEATHER_PARALLEL (in-flight requests, default min(32, 5*cpu_count))
+  WEATHER_GZIP (true: write weather_threats.geojson.gz, gzip level 3, instead of plain JSON)
+  WEATHER_CACHE_TTL (seconds a cell response is reused without asking, default 600; 0 disables the cache)
+Outputs:
+  amenazas/weather_threats.geojson (or .geojson.gz with WEATHER_GZIP)
+  amenazas/.ow_cache.json (per-cell response cache)
+"""
+import os, sys, time, gzip
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+KEY=os.getenv("OPENWEATHER_KEY","").strip()
+if not KEY:
+    print("Falta OPENWEATHER_KEY en .env", file=sys.stderr); sys.exit(1)
+
+ROOT=Path(__file__).resolve().parents[1]
+OUT=ROOT/"amenazas"/"weather_threats.geojson"
+if os.getenv("WEATHER_GZIP","false").lower() in ("true","1","yes"):
+    OUT=OUT.with_name(OUT.name+".gz")
+
+BBOX_S=float(os.getenv("BBOX_S","-33.8"))
+BBOX_W=float(os.getenv("BBOX_W","-70.95"))
+BBOX_N=float(os.getenv("BBOX_N","-33.2"))
+BBOX_E=float(os.getenv("BBOX_E","-70.45"))
+GRID=float(os.getenv("WEATHER_GRID","0.02"))
+# Current conditions come from stations/models far coarser than the 0.02° grid:
+# query once per QUERY_RES bucket and fan the response out to its cells.
+QUERY_RES=float(os.getenv("WEATHER_QUERY_RES","0.1"))
+# Network-bound fan-out: threads mostly wait on sockets, so run many in flight
+# (same default as ThreadPoolExecutor itself) rather than one per core.
+PAR=int(os.getenv("WEATHER_PARALLEL", str(min(32,(os.cpu_count() or 4)*5))))
+RAIN_MM_H=float(os.getenv("RAIN_MM_H","10.0")) # Heavy rain threshold
+WIND_MS=float(os.getenv("WIND_MS","20.0")) # Strong wind (>= 72 km/h)
+VISIBILITY_M=int(os.getenv("VISIBILITY_M","500")) # Low visibility threshold
+SNOW_MM_H=float(os.getenv("SNOW_MM_H","2.0")) # Snow threshold
+
+# OpenWeather condition codes for fog, mist, haze, etc.
+# See: https://openweathermap.org/weather-conditions
+FOG_HAZE_CODES = frozenset({
+    701, # Mist
+    711, # Smoke
+    721, # Haze
+    731, # Sand/dust whirls
+    741, # Fog
+    751, # Sand
+    761, # Dust
+    762, # Volcanic ash
+})
+# Same codes as an int bitmask (bit c set for code c): testing a response is one '&'
+FOG_HAZE_MASK = sum(1 << c for c in FOG_HAZE_CODES)
+
+def _codes_mask(m):
+    mask = 0
+    for w in m.get("weather", []):
+        mask |= 1 << (w.get("id") or 0)
+    return mask
+
+# Shared keep-alive session: every cell hits the same host, so the worker threads
+# reuse pooled TCP/TLS connections instead of handshaking once per cell.
+URL="https://api.openweathermap.org/data/2.5/weather"
+SESSION=requests.Session()
+# Transient 429/5xx are retried inside the pool (honouring Retry-After); the last
+# response is still returned so raise_for_status() reports the real status code.
+RETRY=Retry(total=3, backoff_factor=0.3, status_forcelist=(429,500,502,503,504),
+            allowed_methods=("GET",), raise_on_status=False)
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=PAR, max_retries=RETRY))
+
+# Per-cell response cache on disk. OpenWeather refreshes current conditions about
+# every 10 minutes, so reruns inside that window reuse the stored body; older
+# entries are revalidated with If-None-Match/If-Modified-Since when the server
+# sent validators, and a 304 costs no body and no parse.
+CACHE_TTL=int(os.getenv("WEATHER_CACHE_TTL","600"))
+CACHE_PATH=ROOT/"amenazas"/".ow_cache.json"
+
+def load_cache():
+    if CACHE_TTL<=0 or not CACHE_PATH.exists():
+        return {}
+    try:
+        return orjson.loads(CACHE_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+
+def save_cache(cache):
+    if CACHE_TTL<=0:
+        return
+    tmp=CACHE_PATH.with_name(CACHE_PATH.name+".tmp")
+    tmp.write_bytes(orjson.dumps(cache))
+    tmp.replace(CACHE_PATH)
+
+_CACHE=load_cache()
+
+def grid_cells(s,w,n,e,step):
+    """Grid over the bbox as an (N,6) array of lat,lon,lat2,lon2,clat,clon (row-major, edges clipped)"""
+    la1,lo1=np.meshgrid(np.arange(s,n,step), np.arange(w,e,step), indexing="ij")
+    la2=np.minimum(la1+step, n); lo2=np.minimum(lo1+step, e)
+    return np.stack([la1,lo1,la2,lo2,(la1+la2)/2.0,(lo1+lo2)/2.0], axis=-1).reshape(-1,6)
+
+def cell_rings(cells):
+    """Closed polygon ring [[lon,lat]*5] for every row of grid_cells(), built in one pass"""
+    la1,lo1,la2,lo2=cells[:,0],cells[:,1],cells[:,2],cells[:,3]
+    return np.stack([lo1,la1, lo2,la1, lo2,la2, lo1,la2, lo1,la1], axis=-1).reshape(-1,5,2).tolist()
+
+def query_points(grid, res):
+    """
+    Unique API query points for grid_cells() rows: centers snapped to a res-degree
+    lattice (res<=0 keeps every center). Returns (points (K,2) lat,lon; members,
+    the list of cell indexes served by each point).
+    """
+    centers=grid[:,4:6]
+    if res>0:
+        centers=np.round(np.round(centers/res)*res, 5)
+    points,inverse=np.unique(centers, axis=0, return_inverse=True)
+    members=[[] for _ in range(len(points))]
+    for j,k in enumerate(inverse.reshape(-1).tolist()):
+        members[k].append(j)
+    return points, members
+
+def fetch(lat,lon):
+    key=f"{lat:.5f},{lon:.5f}"
+    hit=_CACHE.get(key) if CACHE_TTL>0 else None
+    now=time.time()
+    if hit and now-hit["t"]<CACHE_TTL:
+        return hit["body"]
+    headers={}
+    if hit:
+        if hit.get("etag"): headers["If-None-Match"]=hit["etag"]
+        if hit.get("lm"): headers["If-Modified-Since"]=hit["lm"]
+    params={"lat":lat,"lon":lon,"appid":KEY,"units":"metric"}
+    r=SESSION.get(URL, params=params, headers=headers, timeout=20)
+    if r.status_code==304 and hit:
+        hit["t"]=now
+        return hit["body"]
+    r.raise_for_status()
+    body=orjson.loads(r.content)
+    if CACHE_TTL>0:
+        _CACHE[key]={"t":now, "etag":r.headers.get("ETag"), "lm":r.headers.get("Last-Modified"), "body":body}
+    return body
+
+# Completed cells analysed together by get_threats_bulk (and written per flush)
+THREAT_BATCH=256
+
+def _metric(ms, key, sub):
+    """m[key][sub] for every response as float64 (missing/None -> 0.0)"""
+    return np.fromiter(((m.get(key) or {}).get(sub) or 0.0 for m in ms), dtype=np.float64, count=len(ms))
+
+def get_threats_bulk(ms):
+    """
+    Analyzes a batch of weather responses with vectorized threshold checks.
+    Returns one list of threat dictionaries per response, in input order
+    (same content and order as the per-condition rules below, evaluated for all cells at once).
+    """
+    n=len(ms)
+    rain=_metric(ms, "rain", "1h")
+    wind=_metric(ms, "wind", "speed")
+    snow=_metric(ms, "snow", "1h")
+    vis=np.fromiter((np.nan if m.get("visibility") is None else m["visibility"] for m in ms), dtype=np.float64, count=n)
+    foggy=np.fromiter((bool(_codes_mask(m) & FOG_HAZE_MASK) for m in ms), dtype=bool, count=n)
+
+    heavy_rain=rain>=RAIN_MM_H            # 1. Heavy Rain
+    strong_wind=wind>=WIND_MS             # 2. Strong Wind
+    low_vis=(vis<=VISIBILITY_M)|foggy     # 3. Low Visibility (Fog, Mist, etc.); NaN never compares true
+    snowing=snow>=SNOW_MM_H               # 4. Snow
+
+    out=[[] for _ in range(n)]
+    for j in np.flatnonzero(heavy_rain|strong_wind|low_vis|snowing).tolist():
+        threats=out[j]
+        if heavy_rain[j]:
+            threats.append({
+                "subtype": "HEAVY_RAIN",
+                "severity": 2 if rain[j] > 10.0 else 1, # Higher severity for very heavy rain
+                "metrics": {"rain_mm_h": float(rain[j])}
+            })
+        if strong_wind[j]:
+            threats.append({
+                "subtype": "STRONG_WIND",
+                "severity": 2 if wind[j] > 17.5 else 1, # Higher severity for gale-force winds
+                "metrics": {"wind_ms": float(wind[j])}
+            })
+        if low_vis[j]:
+            visibility_m=ms[j].get("visibility")
+            threats.append({
+                "subtype": "LOW_VISIBILITY",
+                "severity": 2 if vis[j] < 200 else 1,
+                "metrics": {"visibility_m": visibility_m or "N/A"}
+            })
+        if snowing[j]:
+            threats.append({
+                "subtype": "SNOW",
+                "severity": 2 if snow[j] > 5.0 else 1,
+                "metrics": {"snow_mm_h": float(snow[j])}
+            })
+    return out
+
+def get_threats(m):
+    """Threat dictionaries for a single weather response (see get_threats_bulk)."""
+    return get_threats_bulk([m])[0]
+
+def main():
+    grid=grid_cells(BBOX_S,BBOX_W,BBOX_N,BBOX_E,GRID)
+    rings=cell_rings(grid)
+    cells=grid.tolist()
+    points,members=query_points(grid, QUERY_RES)
+    points=points.tolist()
+    print(f"[INFO] Fetching weather data for {len(cells)} grid cells ({len(points)} API queries)...")
+    print(f"[INFO] Using API key: {KEY[:10]}...{KEY[-4:]}")
+    
+    nfeats=0
+    errors=[]
+    # Features are streamed to a temp file as results arrive and only moved over
+    # OUT at the end, so memory does not grow with the grid and a failed run
+    # never clobbers the previous output.
+    tmp=OUT.with_name(OUT.name+".tmp")
+
+    def flush(fh, pending):
+        """Analyse a batch of (cell index, response) at once and write its features"""
+        nonlocal nfeats
+        for (j,res),threats in zip(pending, get_threats_bulk([res for _,res in pending])):
+            if not threats:
+                continue
+            cell=cells[j]
+            # Most cells have no threat; build and encode the ring only when one
+            # does, once per cell, and splice the bytes into each of its features.
+            poly=orjson.Fragment(orjson.dumps({"type":"Polygon","coordinates":[rings[j]]}))
+            ext_prefix=f"ow:{cell[4]:.3f},{cell[5]:.3f}:"
+            ts=res.get("dt")
+
+            for threat in threats:
+                props={
+                    "provider": "OpenWeather",
+                    "ext_id": ext_prefix+threat["subtype"],
+                    "kind": "weather",
+                    "subtype": threat["subtype"],
+                    "severity": threat["severity"],
+                    "metrics": threat["metrics"],
+                    "ts": ts
+                }
+                if nfeats: fh.write(b",")
+                fh.write(orjson.dumps({"type":"Feature","geometry":poly,"properties":props}))
+                nfeats+=1
+        pending.clear()
+
+    try:
+        opener=(lambda p: gzip.open(p,"wb",compresslevel=3)) if OUT.suffix==".gz" else (lambda p: open(p,"wb"))
+        with opener(tmp) as fh, ThreadPoolExecutor(max_workers=PAR) as ex:
+            fh.write(b'{"type":"FeatureCollection","features":[')
+            # as_completed yields in completion order: map each future back to its query point
+            fut_to_point={ex.submit(fetch, lat, lon): k for k, (lat, lon) in enumerate(points)}
+            pending=[]
+            for i, fut in enumerate(as_completed(fut_to_point)):
+                k=fut_to_point[fut]; lat, lon=points[k]
+                try:
+                    res=fut.result()
+                    # One response serves every cell of the bucket
+                    pending.extend((j, res) for j in members[k])
+                    if len(pending)>=THREAT_BATCH:
+                        flush(fh, pending)
+                except Exception as e:
+                    error_msg = str(e)
+                    # Log first few errors to help diagnose issues
+                    if len(errors) < 3:
+                        print(f"[WARN] Error fetching point {lat:.3f},{lon:.3f}: {error_msg}", file=sys.stderr)
+                    errors.append(error_msg)
+                finally:
+                    if (i + 1) % 10 == 0:
+                        print(f"[INFO] Processed {i + 1}/{len(points)} queries...")
+            flush(fh, pending)
+            fh.write(b"]}")
+        save_cache(_CACHE)
+        
+        if errors:
+            print(f"[WARN] Encountered {len(errors)} errors during fetch", file=sys.stderr)
+            if "401" in str(errors[0]) or "Unauthorized" in str(errors[0]):
+                print("[ERROR] API key unauthorized. The key may not be activated yet.", file=sys.stderr)
+                print("[ERROR] New OpenWeather API keys can take up to 2 hours to activate.", file=sys.stderr)
+                print("[ERROR] Please wait for activation or check your API key.", file=sys.stderr)
+            elif "403" in str(errors[0]) or "Forbidden" in str(errors[0]):
+                print("[ERROR] API key forbidden. The key may be invalid or expired.", file=sys.stderr)
+            
+            # If all cells failed, don't overwrite existing file
+            if nfeats == 0:
+                if OUT.exists():
+                    print(f"[WARN] All fetches failed. Keeping existing {OUT} to preserve data.", file=sys.stderr)
+                    return
+                else:
+                    print(f"[ERROR] All fetches failed and no existing file. Creating empty file.", file=sys.stderr)
+        
+        tmp.replace(OUT)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    print(f"[OK] saved {OUT} ({nfeats} features, {len(errors)} errors)")
+
+if __name__=="__main__":
+    main()
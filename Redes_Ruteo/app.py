@@ -6,127 +6,66 @@ Provides the main interface and API endpoints for threat data.
 """
 
 import os
-import json
+import decimal
 import time
 import random
 import math
-from flask import Flask, render_template, jsonify, request, send_from_directory
+import datetime
+import hashlib
+import orjson
+from flask import Flask, render_template, jsonify, request, send_from_directory, g
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor, register_default_json, register_default_jsonb
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask(__name__)
-
-def simulate_random_failures_on_route(cur, route_edges, route_geom):
-    """
-    Simulate random failures on a calculated route.
-    Returns simulated threats that should be visible on the map.
-    """
-    if not route_edges:
-        return []
-
-    # Determine how many failures to simulate (at least 1, up to 30% of route edges)
-    num_failures = max(1, min(len(route_edges) // 3, random.randint(1, max(1, len(route_edges) // 2))))
-
-    # Randomly select edges from the route
-    selected_edges = random.sample(route_edges, min(num_failures, len(route_edges)))
-
-    simulated_threats = []
-
-    # Threat types and their properties
-    threat_types = [
-        # Waze incidents
-        {
-            'type': 'waze',
-            'subtypes': ['TRAFFIC_JAM', 'CLOSURE'],
-            'severities': [1, 2, 3, 4, 5],
-            'probabilities': [0.2, 0.7]  # Corresponding to subtypes
-        },
-        # Weather threats
-        {
-            'type': 'weather',
-            'subtypes': ['HEAVY_RAIN', 'STRONG_WIND', 'LOW_VISIBILITY', 'SNOW'],
-            'severities': [1, 2, 3, 4, 5],
-            'probabilities': [0.05, 0.04, 0.08, 0.1]  # Base probabilities
-        },
-        # Non-functional hydrants (only these are threats)
-        {
-            'type': 'hydrant',
-            'subtypes': ['NON_FUNCTIONAL'],
-            'severities': [3, 4, 5],  # Higher severity for non-functional hydrants
-            'probabilities': [0.15]  # Probability of being non-functional
-        }
-    ]
-
-    for edge_id in selected_edges:
-        # Get edge geometry and midpoint
-        cur.execute("""
-            SELECT ST_AsGeoJSON(ST_LineInterpolatePoint(geom, 0.5)) as midpoint,
-                   ST_AsGeoJSON(geom) as geom
-            FROM rr.ways
-            WHERE id = %s
-        """, (edge_id,))
 
-        edge_result = cur.fetchone()
-        if not edge_result:
-            continue
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson: jsonify() and request.get_json() use it."""
 
-        midpoint_geojson = json.loads(edge_result[0])
-        edge_geom = json.loads(edge_result[1])
+    @staticmethod
+    def _default(obj):
+        # NUMERIC columns (fail_prob, costs) come back as Decimal
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        raise TypeError
 
-        # Randomly select threat type
-        threat_type = random.choice(threat_types)
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self._default).decode()
 
-        # Select subtype and corresponding probability
-        subtype_idx = random.randrange(len(threat_type['subtypes']))
-        subtype = threat_type['subtypes'][subtype_idx]
-        base_prob = threat_type['probabilities'][subtype_idx]
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-        # Random severity
-        severity = random.choice(threat_type['severities'])
-
-        # Calculate final probability (base_prob + severity adjustment)
-        final_probability = min(0.9, base_prob + (severity * 0.1))
-
-        # Create threat feature
-        threat_feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': midpoint_geojson['coordinates']
-            },
-            'properties': {
-                'id': f"simulated_{threat_type['type']}_{edge_id}_{random.randint(1000, 9999)}",
-                'source': threat_type['type'],
-                'subtype': subtype,
-                'severity': severity,
-                'probability': final_probability,
-                'edge_id': edge_id,
-                'simulated': True,
-                'timestamp': datetime.now().isoformat()
-            }
-        }
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self._default), mimetype='application/json')
 
-        # Add type-specific properties
-        if threat_type['type'] == 'waze':
-            threat_feature['properties']['description'] = f"Incidente simulado: {subtype.replace('_', ' ').title()}"
-            threat_feature['properties']['street'] = f"Calle simulada {random.randint(1, 1000)}"
-        elif threat_type['type'] == 'weather':
-            threat_feature['properties']['description'] = f"Condición climática simulada: {subtype.replace('_', ' ').title()}"
-            if subtype == 'HEAVY_RAIN':
-                threat_feature['properties']['metrics'] = {'rain_mm_h': random.uniform(5, 20)}
-            elif subtype == 'STRONG_WIND':
-                threat_feature['properties']['metrics'] = {'wind_ms': random.uniform(10, 25)}
-        elif threat_type['type'] == 'hydrant':
-            threat_feature['properties']['description'] = "Hidrante no funcional simulado"
-            threat_feature['properties']['status'] = "non_functional"
-            threat_feature['properties']['ext_id'] = f"SIM_H_{random.randint(10000, 99999)}"
 
-        simulated_threats.append(threat_feature)
+app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Compressed responses (GeoJSON compresses ~10x) at a low level to keep CPU per
+# request low. Each algorithm has its own key: COMPRESS_LEVEL is gzip only.
+app.config['COMPRESS_LEVEL'] = 3
+app.config['COMPRESS_BR_LEVEL'] = 3
+app.config['COMPRESS_DEFLATE_LEVEL'] = 3
+# br first (browsers send it), gzip for the rest. Streamed bodies (/api/threats,
+# NDJSON routes) ignore this list: Flask-Compress picks their algorithm from
+# COMPRESS_ALGORITHM_STREAMING (default zstd, br, deflate; it can't stream gzip),
+# pinned too so zstd-capable browsers don't get a different encoding there.
+# Tiny payloads go as-is.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'deflate']
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
 
-    return simulated_threats
 
 # Database configuration
 PGHOST = os.getenv("PGHOST", "localhost")
@@ -134,17 +73,124 @@ PGPORT = int(os.getenv("PGPORT", "5432"))
 PGDATABASE = os.getenv("PGDATABASE", "rr")
 PGUSER = os.getenv("PGUSER", "postgres")
 PGPASSWORD = os.getenv("PGPASSWORD", "postgres")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Seconds a request waits for a free pooled connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Connections are reused across requests instead of paying connect + auth on
+# every hit. Created lazily so importing the app does not require a database.
+_db_pool = None
+_db_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises as soon as it is exhausted; with more threads or
+# gevent greenlets than DB_POOL_MAX, callers queue here for a free slot instead.
+_db_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers whether its per-session setup already ran."""
+    initialized = False
+
+
+# Statements planned once per pooled connection (PREPARE lives as long as the
+# session) and run with EXECUTE name(...) on every later request.
+PREPARED_STATEMENTS = {
+    # Nearest connected vertex to the route start ($1,$2) and end ($3,$4)
+    'nearest_nodes': """
+        PREPARE nearest_nodes(float8, float8, float8, float8) AS
+        SELECT (SELECT v.id FROM rr.ways_vertices_pgr v
+                JOIN rr.components c ON v.id = c.node
+                WHERE c.component = 1
+                ORDER BY v.the_geom <-> ST_SetSRID(ST_MakePoint($1, $2), 4326)
+                LIMIT 1) as source_node,
+               (SELECT v.id FROM rr.ways_vertices_pgr v
+                JOIN rr.components c ON v.id = c.node
+                WHERE c.component = 1
+                ORDER BY v.the_geom <-> ST_SetSRID(ST_MakePoint($3, $4), 4326)
+                LIMIT 1) as target_node
+    """,
+}
+
+
+def get_db_pool():
+    """Return the shared ThreadedConnectionPool, creating it on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX,
+                    host=PGHOST,
+                    port=PGPORT,
+                    dbname=PGDATABASE,
+                    user=PGUSER,
+                    password=PGPASSWORD,
+                    connection_factory=PooledConnection
+                )
+    return _db_pool
+
+
+def checkout_db_connection():
+    """Take a connection from the pool, waiting up to DB_POOL_TIMEOUT for a free one."""
+    if not _db_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("timed out waiting for a pooled connection")
+    try:
+        return get_db_pool().getconn()
+    except Exception:
+        _db_slots.release()
+        raise
 
 
-def get_db_connection():
-    """Create and return a database connection."""
-    conn = psycopg2.connect(
-        host=PGHOST,
-        port=PGPORT,
-        dbname=PGDATABASE,
-        user=PGUSER,
-        password=PGPASSWORD
-    )
+def try_checkout_db_connection():
+    """Extra pooled connection for side work, or None when no slot is free right now."""
+    if not _db_slots.acquire(blocking=False):
+        return None
+    try:
+        conn = get_db_pool().getconn()
+    except Exception:
+        _db_slots.release()
+        raise
+    if not conn.initialized:
+        init_connection(conn)
+    return conn
+
+
+def release_db_connection(conn):
+    """Return a connection obtained from get_db_connection() to the pool (rolls back any open transaction)."""
+    try:
+        get_db_pool().putconn(conn, close=bool(conn.closed))
+    finally:
+        _db_slots.release()
+
+
+# Set once migrate_schema() has run in this process; later requests skip the probes
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def ensure_schema(conn):
+    """Run migrate_schema() once per process (and one process at a time, via an advisory lock)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with conn.cursor() as cur:
+            # Other gunicorn workers wait here and then find nothing left to do
+            cur.execute("SELECT pg_advisory_lock(hashtext('rr.ensure_schema'))")
+        try:
+            migrate_schema(conn)
+            _schema_ready = True
+        finally:
+            conn.rollback()
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtext('rr.ensure_schema'))")
+            conn.commit()
+
+
+def migrate_schema(conn):
+    """Add rr.ways.fail_prob and vertex coordinates, fill NULL vertex geometries and index vertices if the network still lacks them."""
     # Ensure fail_prob column exists
     with conn.cursor() as cur:
         cur.execute("""
@@ -156,6 +202,21 @@ def get_db_connection():
             cur.execute("ALTER TABLE rr.ways ADD COLUMN fail_prob NUMERIC DEFAULT 0")
             conn.commit()
             app.logger.info("Column 'fail_prob' added successfully.")
+
+        # Ensure threat tables carry updated_at (version for the /api/threats ETag)
+        cur.execute("""
+            SELECT t FROM unnest(ARRAY['amenazas_waze','amenazas_calming','amenazas_clima']) t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'rr' AND table_name = t AND column_name = 'updated_at'
+            )
+        """)
+        missing = [r[0] for r in cur.fetchall()]
+        for table in missing:
+            cur.execute(f"ALTER TABLE rr.{table} ADD COLUMN updated_at TIMESTAMPTZ DEFAULT NOW()")
+        if missing:
+            conn.commit()
+            app.logger.info(f"Column 'updated_at' added to {', '.join(missing)}.")
             
         # Ensure vertices geometries are populated
         cur.execute("""
@@ -182,8 +243,108 @@ def get_db_connection():
             """)
             conn.commit()
             app.logger.info("Vertices geometries populated successfully.")
-            
-    return conn
+
+        # A* needs each edge's endpoint coordinates: keep them on rr.ways (x1,y1 =
+        # source, x2,y2 = target) so its edge SQL is a plain scan, not two joins
+        # against the vertices on every route request.
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'rr' AND table_name = 'ways' AND column_name = 'x1'
+        """)
+        if cur.fetchone() is None:
+            app.logger.info("Vertex coordinates not found in 'rr.ways'. Adding x1, y1, x2, y2 now.")
+            cur.execute("""
+                ALTER TABLE rr.ways ADD COLUMN x1 float8, ADD COLUMN y1 float8,
+                                    ADD COLUMN x2 float8, ADD COLUMN y2 float8;
+                CREATE OR REPLACE FUNCTION rr.ways_set_vertex_xy() RETURNS trigger AS $$
+                BEGIN
+                    SELECT ST_X(the_geom), ST_Y(the_geom) INTO NEW.x1, NEW.y1
+                    FROM rr.ways_vertices_pgr WHERE id = NEW.source;
+                    SELECT ST_X(the_geom), ST_Y(the_geom) INTO NEW.x2, NEW.y2
+                    FROM rr.ways_vertices_pgr WHERE id = NEW.target;
+                    RETURN NEW;
+                END $$ LANGUAGE plpgsql;
+                CREATE TRIGGER ways_vertex_xy BEFORE INSERT OR UPDATE OF source, target ON rr.ways
+                    FOR EACH ROW EXECUTE FUNCTION rr.ways_set_vertex_xy();
+            """)
+            conn.commit()
+        cur.execute("""
+            UPDATE rr.ways w
+            SET x1 = ST_X(sv.the_geom), y1 = ST_Y(sv.the_geom),
+                x2 = ST_X(tv.the_geom), y2 = ST_Y(tv.the_geom)
+            FROM rr.ways_vertices_pgr sv, rr.ways_vertices_pgr tv
+            WHERE w.source = sv.id AND w.target = tv.id
+              AND (w.x1 IS NULL OR w.x2 IS NULL)
+              AND sv.the_geom IS NOT NULL AND tv.the_geom IS NOT NULL
+        """)
+        if cur.rowcount > 0:
+            app.logger.info(f"Vertex coordinates filled for {cur.rowcount} edges.")
+        conn.commit()
+
+        # Nearest-node lookups (ORDER BY the_geom <-> point LIMIT 1) are only a
+        # bounded KNN walk with a GiST index on the_geom; the component filter
+        # joins through rr.components(node).
+        cur.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_indexes
+                    WHERE schemaname='rr' AND tablename='ways_vertices_pgr' AND indexname='ways_vertices_the_geom_gix'
+                ) THEN
+                    EXECUTE 'CREATE INDEX ways_vertices_the_geom_gix ON rr.ways_vertices_pgr USING GIST (the_geom)';
+                END IF;
+                IF to_regclass('rr.components') IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM pg_indexes
+                    WHERE schemaname='rr' AND tablename='components' AND indexname='components_node_idx'
+                ) THEN
+                    EXECUTE 'CREATE INDEX components_node_idx ON rr.components (node, component)';
+                END IF;
+            END$$;
+        """)
+        conn.commit()
+
+
+def init_connection(conn):
+    """Per-session setup, run the first time a pooled connection is handed out."""
+    # json/jsonb columns (props, ST_AsGeoJSON(...)::jsonb, route geometry) are decoded once, by orjson
+    register_default_json(conn_or_curs=conn, loads=orjson.loads)
+    register_default_jsonb(conn_or_curs=conn, loads=orjson.loads)
+    try:
+        with conn.cursor() as cur:
+            for sql in PREPARED_STATEMENTS.values():
+                cur.execute(sql)
+        conn.commit()
+    except psycopg2.Error as e:
+        # e.g. rr.components not built yet: leave it for the next checkout
+        conn.rollback()
+        app.logger.warning(f"Could not prepare statements: {str(e)}")
+        return
+    conn.initialized = True
+
+
+def get_db_connection():
+    """
+    Connection for the current request, checked out of the pool on first use and
+    kept on flask.g; close_db_connection() gives it back when the app context ends.
+    """
+    if 'db' not in g:
+        conn = checkout_db_connection()
+        try:
+            ensure_schema(conn)
+            if not conn.initialized:
+                init_connection(conn)
+        except Exception:
+            release_db_connection(conn)
+            raise
+        g.db = conn
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db_connection(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        release_db_connection(conn)
 
 
 @app.route('/')
@@ -202,115 +363,123 @@ def metadata_files(filename):
     return send_from_directory('metadata', filename)
 
 
+# Rows per FETCH from the /api/threats server-side cursor (and per streamed chunk)
+THREATS_BATCH = 2000
+# Clients may reuse a /api/threats body this long before revalidating with If-None-Match
+THREATS_MAX_AGE = 60
+# Seconds the last complete /api/threats body is served from memory without asking
+# the database; after that a matching version query still reuses it (0 disables)
+THREATS_CACHE_TTL = int(os.getenv("THREATS_CACHE_TTL", "30"))
+# (monotonic time checked, etag, body bytes) of the last complete response, per process
+_threats_cache = None
+
+
+# One GeoJSON Feature per row, built by PostgreSQL (props merged over the base
+# columns) and sent as text: Python only splices the bytes, it never decodes the
+# jsonb nor re-encodes a dict.
+THREAT_SOURCES = (
+    ('rr.amenazas_waze', 'waze'),
+    ('rr.amenazas_calming', 'traffic_calming'),
+    ('rr.amenazas_clima', 'weather'),
+)
+THREAT_FEATURE_SELECT = """
+    SELECT json_build_object(
+               'type', 'Feature',
+               'properties', jsonb_build_object('ext_id', ext_id, 'kind', kind, 'subtype', subtype,
+                                                'severity', severity, 'source', '{source}')
+                             || coalesce(props, '{{}}'::jsonb),
+               'geometry', ST_AsGeoJSON(geom)::json
+           )::text
+    FROM {table}"""
+THREATS_SQL = "\nUNION ALL\n".join(
+    THREAT_FEATURE_SELECT.format(table=table, source=source) for table, source in THREAT_SOURCES)
+# Viewport variant (?bbox=): each branch walks its geom GiST index
+THREATS_BBOX_SQL = "\nUNION ALL\n".join(
+    THREAT_FEATURE_SELECT.format(table=table, source=source)
+    + "\n    WHERE geom && ST_MakeEnvelope(%(minx)s, %(miny)s, %(maxx)s, %(maxy)s, 4326)"
+    for table, source in THREAT_SOURCES)
+
+
+def threats_version(conn):
+    """ETag for the threat tables: latest upsert plus row counts (catches deletes)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT (SELECT max(updated_at) FROM rr.amenazas_waze),    (SELECT count(*) FROM rr.amenazas_waze),
+                   (SELECT max(updated_at) FROM rr.amenazas_calming), (SELECT count(*) FROM rr.amenazas_calming),
+                   (SELECT max(updated_at) FROM rr.amenazas_clima),   (SELECT count(*) FROM rr.amenazas_clima)
+        """)
+        return hashlib.md5(repr(cur.fetchone()).encode()).hexdigest()
+
+
+def parse_bbox(value):
+    """'minx,miny,maxx,maxy' (lon/lat) -> dict of floats; ValueError if malformed."""
+    minx, miny, maxx, maxy = (float(v) for v in value.split(','))
+    if not (minx < maxx and miny < maxy):
+        raise ValueError("bbox min must be below max")
+    return {"minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy}
+
+
+def client_has_etag(etag):
+    """True when the request's If-None-Match already names etag."""
+    # Flask-Compress suffixes the tag with the coding ("<md5>:br"); compare the base
+    return any(t.split(':')[0] == etag for t in request.if_none_match.as_set(include_weak=True))
+
+
+def threats_response(etag, body=None):
+    """Cacheable /api/threats response: 304 when the client holds etag, else body."""
+    if client_has_etag(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f'public, max-age={THREATS_MAX_AGE}'
+    return resp
+
+
 @app.route('/api/threats')
 def api_threats():
     """
     API endpoint to retrieve all threats from the database.
-    Returns GeoJSON FeatureCollection with threats from multiple sources.
+    Returns GeoJSON FeatureCollection with threats from multiple sources,
+    streamed in batches from a server-side cursor and kept in memory
+    (see THREATS_CACHE_TTL) for the following requests.
+    Optional ?bbox=minx,miny,maxx,maxy limits it to features intersecting that
+    box (viewport requests are not kept in memory).
     """
+    global _threats_cache
+    bbox = None
+    if request.args.get('bbox'):
+        try:
+            bbox = parse_bbox(request.args['bbox'])
+        except ValueError:
+            return jsonify({
+                "error": "Invalid bbox. Expected: minx,miny,maxx,maxy"
+            }), 400
+    cached = _threats_cache if THREATS_CACHE_TTL > 0 and bbox is None else None
+    if cached and time.monotonic() - cached[0] < THREATS_CACHE_TTL:
+        return threats_response(cached[1], cached[2])
+
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        features = []
-        
-        # Query Waze threats
-        cur.execute("""
-            SELECT 
-                ext_id,
-                kind,
-                subtype,
-                severity,
-                props,
-                ST_AsGeoJSON(geom) as geometry
-            FROM rr.amenazas_waze
-        """)
-        
-        for row in cur.fetchall():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "ext_id": row['ext_id'],
-                    "kind": row['kind'],
-                    "subtype": row['subtype'],
-                    "severity": row['severity'],
-                    "source": "waze"
-                },
-                "geometry": json.loads(row['geometry'])
-            }
-            # Merge additional properties from props JSONB field
-            if row['props']:
-                feature['properties'].update(row['props'])
-            
-            features.append(feature)
-        
-        # Query Traffic Calming threats
-        cur.execute("""
-            SELECT 
-                ext_id,
-                kind,
-                subtype,
-                severity,
-                props,
-                ST_AsGeoJSON(geom) as geometry
-            FROM rr.amenazas_calming
-        """)
-        
-        for row in cur.fetchall():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "ext_id": row['ext_id'],
-                    "kind": row['kind'],
-                    "subtype": row['subtype'],
-                    "severity": row['severity'],
-                    "source": "traffic_calming"
-                },
-                "geometry": json.loads(row['geometry'])
-            }
-            if row['props']:
-                feature['properties'].update(row['props'])
-            
-            features.append(feature)
-        
-        # Query Weather threats
-        cur.execute("""
-            SELECT 
-                ext_id,
-                kind,
-                subtype,
-                severity,
-                props,
-                ST_AsGeoJSON(geom) as geometry
-            FROM rr.amenazas_clima
-        """)
-        
-        for row in cur.fetchall():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "ext_id": row['ext_id'],
-                    "kind": row['kind'],
-                    "subtype": row['subtype'],
-                    "severity": row['severity'],
-                    "source": "weather"
-                },
-                "geometry": json.loads(row['geometry'])
-            }
-            if row['props']:
-                feature['properties'].update(row['props'])
-            
-            features.append(feature)
-        
-        cur.close()
-        conn.close()
-        
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features
-        }
+        etag = threats_version(conn)
+        if bbox is not None:
+            etag = hashlib.md5(f"{etag}:{request.args['bbox']}".encode()).hexdigest()
+        if cached and cached[1] == etag:
+            # Tables unchanged since the body was built: reuse it for another TTL
+            _threats_cache = (time.monotonic(), etag, cached[2])
+            return threats_response(etag, cached[2])
+        if client_has_etag(etag):
+            return threats_response(etag)
+        # Named cursor: rows stay on the server and come over THREATS_BATCH at a time
+        cur = conn.cursor(name='threats_cur')
         
-        return jsonify(geojson)
+        # Waze, traffic calming and weather threats in a single round trip
+        if bbox is None:
+            cur.execute(THREATS_SQL)
+        else:
+            cur.execute(THREATS_BBOX_SQL, bbox)
+        # First FETCH runs the query: errors surface here, while a 500 can still be sent
+        rows = cur.fetchmany(THREATS_BATCH)
     
     except Exception as e:
         # Log the error for debugging but don't expose details to clients
@@ -321,6 +490,46 @@ def api_threats():
             "error": "Failed to load threat data"
         }), 500
 
+    # The body is produced after the app context is torn down: the response takes
+    # the connection off g and returns it to the pool when it is closed. That also
+    # covers a body that is never iterated (HEAD, client gone before the first chunk).
+    g.pop('db')
+
+    def release():
+        cur.close()
+        release_db_connection(conn)
+
+    def generate(rows):
+        global _threats_cache
+        # Only the full collection is cached; viewport bodies are just streamed
+        keep = THREATS_CACHE_TTL > 0 and bbox is None
+        chunks = []
+        try:
+            chunks.append(b'{"type":"FeatureCollection","features":[')
+            yield chunks[-1]
+            sep = b''
+            while rows:
+                chunk = sep + ','.join(row[0] for row in rows).encode()
+                if keep:
+                    chunks.append(chunk)
+                yield chunk
+                sep = b','
+                rows = cur.fetchmany(THREATS_BATCH)
+            chunks.append(b']}')
+            yield chunks[-1]
+            # Only a body that streamed to the end is worth keeping
+            if keep:
+                _threats_cache = (time.monotonic(), etag, b''.join(chunks))
+        except Exception as e:
+            # Headers (200, ETag) are already out: re-raise so the server aborts the
+            # connection instead of ending a truncated body as if it were complete
+            app.logger.error(f"Error streaming threats: {str(e)}")
+            raise
+
+    resp = threats_response(etag, generate(rows))
+    resp.call_on_close(release)
+    return resp
+
 
 @app.route('/api/hydrants')
 def api_hydrants():
@@ -330,47 +539,28 @@ def api_hydrants():
     """
     try:
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        features = []
+        cur = conn.cursor()
         
-        # Query Hydrants
+        # Whole FeatureCollection built by Postgres (props merged over the base
+        # columns) and sent as text: nothing is decoded or re-encoded in Python
         cur.execute("""
-            SELECT 
-                ext_id,
-                status,
-                provider,
-                props,
-                ST_AsGeoJSON(geom) as geometry
+            SELECT json_build_object(
+                       'type', 'FeatureCollection',
+                       'features', coalesce(json_agg(json_build_object(
+                           'type', 'Feature',
+                           'properties', jsonb_build_object('ext_id', ext_id, 'status', status, 'provider', provider)
+                                         || coalesce(props, '{}'::jsonb),
+                           'geometry', ST_AsGeoJSON(geom)::json
+                       )), '[]'::json)
+                   )::text
             FROM rr.metadata_hydrants
             WHERE geom IS NOT NULL
         """)
         
-        for row in cur.fetchall():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "ext_id": row['ext_id'],
-                    "status": row['status'],
-                    "provider": row['provider']
-                },
-                "geometry": json.loads(row['geometry'])
-            }
-            # Merge additional properties from props JSONB field
-            if row['props']:
-                feature['properties'].update(row['props'])
-            
-            features.append(feature)
-        
+        body = cur.fetchone()[0]
         cur.close()
-        conn.close()
         
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features
-        }
-        
-        return jsonify(geojson)
+        return app.response_class(body, mimetype='application/json')
     
     except Exception as e:
         # Log the error for debugging but don't expose details to clients
@@ -382,51 +572,92 @@ def api_hydrants():
         }), 500
 
 
-def build_route_geojson(cur, route_segments_query, params, start_lng=None, start_lat=None, end_lng=None, end_lat=None):
+# Edge sets handed to pgRouting as plain text parameters, so nothing is
+# interpolated into SQL per request.
+EDGES_DISTANCE_SQL = "SELECT w.id, w.source, w.target, w.length_m as cost FROM rr.ways w"
+EDGES_WEIGHTED_SQL = "SELECT w.id, w.source, w.target, w.cost_combined as cost FROM rr.ways w WHERE w.cost_combined > 0"
+# A* emphasizes distance a bit more; x1..y2 feed its heuristic
+EDGES_ASTAR_SQL = """
+    SELECT w.id, w.source, w.target,
+           w.cost_combined * 0.8 + w.length_m * 0.2 as cost,
+           w.x1, w.y1, w.x2, w.y2
+    FROM rr.ways w
+    WHERE w.cost_combined > 0
+      AND w.x1 IS NOT NULL AND w.x2 IS NOT NULL
+"""
+# Risk-constrained approximation: high fail_prob edges become very expensive
+EDGES_RISK_SQL = """
+    SELECT w.id, w.source, w.target,
+           w.cost_combined * (1 + COALESCE(w.fail_prob, 0) * 10) as cost
+    FROM rr.ways w
+    WHERE w.cost_combined > 0
+"""
+
+# Route segments ($1 edges SQL, $2 source, $3 target) merged into one line with
+# its length and cost. {route} is the pgRouting call.
+ROUTE_GEOJSON_SQL = """
+    WITH route AS ({route}),
+         route_geoms AS (
+            SELECT r.seq, w.geom
+            FROM route r
+            JOIN rr.ways w ON r.edge = w.id
+            WHERE r.edge > 0
+            ORDER BY r.seq
+         ),
+         merged_line AS (
+            SELECT ST_LineMerge(ST_Collect(geom ORDER BY seq)) as geom
+            FROM route_geoms
+         ),
+         route_line AS (
+            SELECT ml.geom,
+                   (SELECT COALESCE(SUM(w.length_m), 0)
+                    FROM route r JOIN rr.ways w ON r.edge = w.id WHERE r.edge > 0) as total_length,
+                   (SELECT COALESCE(SUM(r.cost), 0) FROM route r WHERE r.edge > 0) as total_cost
+            FROM merged_line ml
+         )
+    SELECT ST_AsGeoJSON(geom)::json as geometry,
+           total_length, total_cost
+    FROM route_line
+"""
+
+# Bidirectional searches: same path and output columns as pgr_dijkstra/pgr_astar,
+# but they grow from both endpoints and settle far fewer vertices on city-wide routes.
+# Prepared per connection; run with build_route_geojson(cur, name, (edges SQL, source, target)).
+PREPARED_STATEMENTS['route_dijkstra'] = "PREPARE route_dijkstra(text, bigint, bigint) AS " + ROUTE_GEOJSON_SQL.format(
+    route="SELECT seq, edge, cost FROM pgr_bdDijkstra($1, $2, $3, directed := false)")
+PREPARED_STATEMENTS['route_astar'] = "PREPARE route_astar(text, bigint, bigint) AS " + ROUTE_GEOJSON_SQL.format(
+    route="SELECT seq, edge, cost FROM pgr_bdAstar($1, $2, $3, directed := false)")
+
+
+# Edges around the start/end box (expanded by ROUTE_BBOX_MARGIN degrees, ~2 km),
+# found through ways_geom_gix; {edges} is one of the EDGES_*_SQL sets above
+ROUTE_BBOX_EDGES_SQL = """
+    SELECT e.* FROM ({edges}) e
+    JOIN rr.ways b ON b.id = e.id
+    WHERE b.geom && ST_Expand(ST_MakeEnvelope(%s, %s, %s, %s, 4326), %s)
+"""
+ROUTE_BBOX_MARGIN = 0.02
+
+
+def build_route_geojson(cur, route_statement, params, start_lng=None, start_lat=None, end_lng=None, end_lat=None):
     """
-    Helper function to build GeoJSON from a route query.
+    Helper function to build GeoJSON from a prepared route statement
+    ('route_dijkstra' or 'route_astar') and its (edges SQL, source, target) params.
     This version uses the actual way geometries to create smooth routes along streets.
-    Adds connection segments from start/end points to nearest nodes if coordinates provided.
-    """
-    # Build the SQL query with proper parameter handling
-    start_lng_param = start_lng if start_lng is not None else 'NULL'
-    start_lat_param = start_lat if start_lat is not None else 'NULL'
-    end_lng_param = end_lng if end_lng is not None else 'NULL'
-    end_lat_param = end_lat if end_lat is not None else 'NULL'
-
-    sql_query = f"""
-        WITH route AS ({route_segments_query}),
-             route_geoms AS (
-                SELECT r.seq, w.geom
-                FROM route r
-                JOIN rr.ways w ON r.edge = w.id
-                WHERE r.edge > 0
-                ORDER BY r.seq
-             ),
-             merged_line AS (
-                SELECT ST_LineMerge(ST_Collect(geom ORDER BY seq)) as geom
-                FROM route_geoms
-             ),
-             route_line AS (
-                SELECT ml.geom,
-                       (SELECT COALESCE(SUM(w.length_m), 0)
-                        FROM route r JOIN rr.ways w ON r.edge = w.id WHERE r.edge > 0) as total_length,
-                       (SELECT COALESCE(SUM(r.cost), 0) FROM route r WHERE r.edge > 0) as total_cost
-                FROM merged_line ml
-             ),
-             full_route AS (
-                SELECT rl.geom,
-                rl.total_length,
-                rl.total_cost
-                FROM route_line rl
-             )
-        SELECT ST_AsGeoJSON(geom)::json as geometry,
-               total_length, total_cost
-        FROM full_route;
+    With start/end coordinates pgRouting first gets only the edges near them and
+    falls back to the whole graph when no route fits in that box.
     """
-
-    cur.execute(sql_query, params)
-    result = cur.fetchone()
+    result = None
+    if None not in (start_lng, start_lat, end_lng, end_lat):
+        edges_sql, source_node, target_node = params
+        bbox_edges_sql = cur.mogrify(ROUTE_BBOX_EDGES_SQL.format(edges=edges_sql), (
+            min(start_lng, end_lng), min(start_lat, end_lat),
+            max(start_lng, end_lng), max(start_lat, end_lat), ROUTE_BBOX_MARGIN)).decode()
+        cur.execute(f"EXECUTE {route_statement}(%s, %s, %s)", (bbox_edges_sql, source_node, target_node))
+        result = cur.fetchone()
+    if not (result and result['geometry']):
+        cur.execute(f"EXECUTE {route_statement}(%s, %s, %s)", params)
+        result = cur.fetchone()
 
     if result and result['geometry']:
         geojson = {
@@ -437,18 +668,118 @@ def build_route_geojson(cur, route_segments_query, params, start_lng=None, start
             },
             'geometry': result['geometry']
         }
-        coords = geojson.get('geometry', {}).get('coordinates', [])
-        print(f"GeoJSON result: coordinates length = {len(coords)}")
+        app.logger.debug(f"GeoJSON result: coordinates length = {len(geojson['geometry'].get('coordinates', []))}")
         return geojson
 
     # Fallback: return empty route
-    print("Using fallback empty geometry")
+    app.logger.debug("Using fallback empty geometry")
     return {
         'type': 'Feature',
         'properties': {'total_length_m': 0, 'total_cost': 0},
         'geometry': {'type': 'LineString', 'coordinates': []}
     }
-def simulate_random_failures_on_route(route_geojson, cur):
+
+
+# One thread per pooled connection: a connection handed to a route variant is
+# never left waiting in the executor queue.
+_route_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix='route')
+
+
+def run_route_variant(cur, name, fn):
+    """fn(cur) -> result entry or None; errors are logged and count as no route."""
+    try:
+        return fn(cur)
+    except Exception as e:
+        app.logger.error(f"Error calculating {name} route: {str(e)}")
+        # Leave the connection usable for the next variant
+        cur.connection.rollback()
+        return None
+
+
+def run_route_variant_on(conn, name, fn):
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return run_route_variant(cur, name, fn)
+    finally:
+        release_db_connection(conn)
+
+
+def iter_route_variants(cur, variants):
+    """
+    Run the (name, fn) route variants and yield (name, result) as each one finishes
+    (result None when it found no route). They are independent pgRouting jobs: the
+    first runs on the request's cursor while each other one gets its own pooled
+    connection, when a slot is free, and runs concurrently; the rest follow on cur.
+    """
+    futures = {}
+    for name, fn in variants[1:]:
+        conn = try_checkout_db_connection()
+        if conn is None:
+            break
+        futures[_route_executor.submit(run_route_variant_on, conn, name, fn)] = name
+    pooled = set(futures.values())
+    for name, fn in variants:
+        if name not in pooled:
+            yield name, run_route_variant(cur, name, fn)
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+# Seconds a computed route variant is reused for the same snapped nodes (0 disables).
+# Edge costs only change when scripts/probability_model.py rewrites fail_prob,
+# so the TTL is what bounds how stale a cached route can get.
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", "300"))
+ROUTE_CACHE_SIZE = 1024
+# (source_node, target_node, variant, simulate_failures) -> (monotonic time, result), LRU order.
+# The raw start/end coordinates are left out on purpose: build_route_geojson() only
+# uses them for its bbox prefilter, and clicks that snap to the same nodes give
+# boxes that differ by about the snap distance against a ROUTE_BBOX_MARGIN of ~2 km,
+# so the reused route is the one those coordinates would get (the full-graph
+# fallback covers the rest). Keying on them would make every click a miss.
+_route_cache = OrderedDict()
+_route_cache_lock = threading.Lock()
+
+
+def iter_cached_route_variants(source_node, target_node, simulate_failures, cur, variants):
+    """
+    iter_route_variants() behind a per-process LRU: variants already computed for
+    these nodes within ROUTE_CACHE_TTL are yielded first, from memory, and only the
+    rest reach pgRouting. Routes that failed are not kept.
+    A cached entry comes back marked "cached": true, with compute_time_ms set to the
+    lookup time of this request, not the pgRouting time it was first computed in.
+    """
+    if ROUTE_CACHE_TTL <= 0:
+        yield from iter_route_variants(cur, variants)
+        return
+    start_time = time.perf_counter_ns()
+    now = time.monotonic()
+    cached = {}
+    with _route_cache_lock:
+        for name, _ in variants:
+            key = (source_node, target_node, name, simulate_failures)
+            entry = _route_cache.get(key)
+            if entry and now - entry[0] < ROUTE_CACHE_TTL:
+                _route_cache.move_to_end(key)
+                cached[name] = entry[1]
+    lookup_ms = round((time.perf_counter_ns() - start_time) / 1e6, 2)
+    for name, result in cached.items():
+        yield name, dict(result, cached=True, compute_time_ms=lookup_ms)
+    for name, result in iter_route_variants(cur, [(name, fn) for name, fn in variants if name not in cached]):
+        if result:
+            with _route_cache_lock:
+                _route_cache[(source_node, target_node, name, simulate_failures)] = (now, result)
+                while len(_route_cache) > ROUTE_CACHE_SIZE:
+                    _route_cache.popitem(last=False)
+        yield name, result
+
+
+def cached_route_variants(source_node, target_node, simulate_failures, cur, variants):
+    """iter_cached_route_variants() collected as {name: result} in the given order, without the ones lacking a route."""
+    results = dict(iter_cached_route_variants(source_node, target_node, simulate_failures, cur, variants))
+    return {name: results[name] for name, _ in variants if results.get(name)}
+
+
+def simulate_random_failures_on_route(route_geojson):
     """
     Generate random visible threats along a calculated route with dynamic weights.
     Weights are calculated based on realistic factors: distance, threat type, size, density, and response time.
@@ -601,12 +932,10 @@ def simulate_random_failures_on_route(route_geojson, cur):
             base_severity = min(5, base_severity * 1.5)  # Increase severity for blocking obstacles
 
         # Distance factor: closer threats have higher impact
-        segment_length = ((end_coord[0] - start_coord[0])**2 + (end_coord[1] - start_coord[1])**2)**0.5 * 111000
         distance_from_segment = random.uniform(0, 100)  # Random distance from route (0-100m)
         distance_factor = max(0.3, 1.0 - (distance_from_segment / 100))  # 0.3 to 1.0
 
         # Time factor: current time affects threat likelihood
-        import datetime
         current_hour = datetime.datetime.now().hour
         if threat_source == 'waze':
             # Traffic peaks during rush hours
@@ -713,6 +1042,9 @@ def api_calculate_route():
     API endpoint to calculate multiple optimal routes using different algorithms.
     Expects JSON body: {"start": {"lat": y1, "lng": x1}, "end": {"lat": y2, "lng": x2}, "algorithm": "all"}
     Returns: Multiple routes with their computation times
+    With "Accept: application/x-ndjson" each route is streamed as its own
+    {"<algorithm>": {...}} line as soon as it is ready (then simulated_threats,
+    or an {"error": ...} line when no route was found).
     """
     try:
         # Get request data
@@ -744,67 +1076,35 @@ def api_calculate_route():
         end_lat = float(end['lat'])
         end_lng = float(end['lng'])
         
-        print(f"Received coordinates: start=({start_lat}, {start_lng}), end=({end_lat}, {end_lng})")
+        app.logger.debug(f"Received coordinates: start=({start_lat}, {start_lng}), end=({end_lat}, {end_lng})")
         
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Find nearest node to start point
-        cur.execute("""
-            SELECT v.id, ST_X(v.the_geom) as x, ST_Y(v.the_geom) as y
-            FROM rr.ways_vertices_pgr v
-            JOIN rr.components c ON v.id = c.node
-            WHERE c.component = 1
-            ORDER BY v.the_geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-            LIMIT 1
-        """, (start_lng, start_lat))
+        # Nearest connected node to each endpoint, both in one round trip
+        cur.execute("EXECUTE nearest_nodes(%s, %s, %s, %s)", (start_lng, start_lat, end_lng, end_lat))
         
-        start_node_row = cur.fetchone()
-        if not start_node_row:
+        nodes = cur.fetchone()
+        source_node = nodes['source_node']
+        target_node = nodes['target_node']
+        if source_node is None:
             cur.close()
-            conn.close()
             return jsonify({
                 "error": "Could not find start node in network",
                 "details": "No hay nodos de la red cerca del punto de inicio"
             }), 404
-        
-        source_node = start_node_row['id']
-        print(f"Start node found: {source_node}")
-        
-        # Find nearest node to end point
-        cur.execute("""
-            SELECT v.id, ST_X(v.the_geom) as x, ST_Y(v.the_geom) as y
-            FROM rr.ways_vertices_pgr v
-            JOIN rr.components c ON v.id = c.node
-            WHERE c.component = 1
-            ORDER BY v.the_geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
-            LIMIT 1
-        """, (end_lng, end_lat))
-        
-        end_node_row = cur.fetchone()
-        if not end_node_row:
+        if target_node is None:
             cur.close()
-            conn.close()
             return jsonify({
                 "error": "Could not find end node in network",
                 "details": "No hay nodos de la red cerca del punto final"
             }), 404
         
-        target_node = end_node_row['id']
-        target_x = end_node_row['x']
-        target_y = end_node_row['y']
-        print(f"End node found: {target_node}")
+        app.logger.debug(f"Start node found: {source_node}")
+        app.logger.debug(f"End node found: {target_node}")
         
-        results = {}
         simulated_threats = []
 
-        # --- Always use normal routing (no threat data from DB) ---
-        base_routing_query = """
-            SELECT id, source, target, cost_combined as cost
-            FROM rr.ways
-            WHERE cost_combined > 0
-        """
-
         # Generate simulated threats globally (not route-specific) first
         if simulate_failures:
             # Create a simple straight line route for threat generation
@@ -816,147 +1116,145 @@ def api_calculate_route():
                     'coordinates': [[start_lng, start_lat], [end_lng, end_lat]]
                 }
             }
-            simulated_threats = simulate_random_failures_on_route(simple_route, cur)
+            simulated_threats = simulate_random_failures_on_route(simple_route)
         else:
             simulated_threats = []
 
         # --- Algorithm Implementations ---
+        # Each returns its result entry (or None); iter_route_variants() decides
+        # which connection runs it.
 
         # Route 1: Dijkstra with distance only
-        if algorithm == 'all' or algorithm == 'dijkstra_dist':
-            try:
-                start_time = time.time()
-                # Always use simple distance-based routing
-                penalty_clause = f"CASE WHEN w.id IN ({ids_str}) THEN w.length_m * 10 ELSE w.length_m END" if ids_str else "w.length_m"
-                sql_for_pgr = f"SELECT w.id, w.source, w.target, {penalty_clause} as cost FROM rr.ways w"
-                route_query = "SELECT seq, path_seq, node, edge, cost, agg_cost FROM pgr_dijkstra(%s, %s, %s, directed := false)"
-                params = (sql_for_pgr, source_node, target_node)
-
-                app.logger.info(f"Route query: {route_query}")
-                geojson = build_route_geojson(cur, route_query, params, start_lng, start_lat, end_lng, end_lat)
-                compute_time_ms = (time.time() - start_time) * 1000
-
-                results['dijkstra_dist'] = {
-                    "route_geojson": geojson or {"type": "Feature", "properties": {"total_length_m": 0, "total_cost": 0}, "geometry": {"type": "LineString", "coordinates": []}},
-                    "compute_time_ms": round(compute_time_ms, 2),
-                    "algorithm": "Dijkstra (Distancia)" + (" con Amenazas Simuladas" if simulate_failures else ""),
-                    "simulated_threats": []
-                }
-            except Exception as e:
-                app.logger.error(f"Error calculating dijkstra_dist route: {str(e)}")
+        def route_dijkstra_dist(cur):
+            start_time = time.perf_counter_ns()
+            # Always use simple distance-based routing
+            params = (EDGES_DISTANCE_SQL, source_node, target_node)
+            geojson = build_route_geojson(cur, 'route_dijkstra', params, start_lng, start_lat, end_lng, end_lat)
+            compute_time_ms = (time.perf_counter_ns() - start_time) / 1e6
+
+            return {
+                "route_geojson": geojson or {"type": "Feature", "properties": {"total_length_m": 0, "total_cost": 0}, "geometry": {"type": "LineString", "coordinates": []}},
+                "compute_time_ms": round(compute_time_ms, 2),
+                "algorithm": "Dijkstra (Distancia)" + (" con Amenazas Simuladas" if simulate_failures else ""),
+                "simulated_threats": []
+            }
 
         # Route 2: Dijkstra with probability-weighted cost
-        if algorithm == 'all' or algorithm == 'dijkstra_prob':
-            try:
-                start_time = time.time()
-                # Always use pre-calculated cost_combined (no threat data from DB)
-                penalty_clause = f"CASE WHEN w.id IN ({ids_str}) THEN w.cost_combined * 10 ELSE w.cost_combined END" if ids_str else "w.cost_combined"
-                sql_for_pgr = f"SELECT w.id, w.source, w.target, {penalty_clause} as cost FROM rr.ways w WHERE w.cost_combined > 0"
-                route_query = "SELECT seq, path_seq, node, edge, cost, agg_cost FROM pgr_dijkstra(%s, %s, %s, directed := false)"
-                params = (sql_for_pgr, source_node, target_node)
-
-                app.logger.info(f"Route query: {route_query}")
-                geojson = build_route_geojson(cur, route_query, params, start_lng, start_lat, end_lng, end_lat)
-                compute_time_ms = (time.time() - start_time) * 1000
-
-                results['dijkstra_prob'] = {
-                    "route_geojson": geojson or {"type": "Feature", "properties": {"total_length_m": 0, "total_cost": 0}, "geometry": {"type": "LineString", "coordinates": []}},
-                    "compute_time_ms": round(compute_time_ms, 2),
-                    "algorithm": "Dijkstra (Ponderado)" + (" con Amenazas Simuladas" if simulate_failures else ""),
-                    "simulated_threats": []
-                }
-            except Exception as e:
-                app.logger.error(f"Error calculating dijkstra_prob route: {str(e)}")
+        def route_dijkstra_prob(cur):
+            start_time = time.perf_counter_ns()
+            # Always use pre-calculated cost_combined (no threat data from DB)
+            params = (EDGES_WEIGHTED_SQL, source_node, target_node)
+            geojson = build_route_geojson(cur, 'route_dijkstra', params, start_lng, start_lat, end_lng, end_lat)
+            compute_time_ms = (time.perf_counter_ns() - start_time) / 1e6
+
+            return {
+                "route_geojson": geojson or {"type": "Feature", "properties": {"total_length_m": 0, "total_cost": 0}, "geometry": {"type": "LineString", "coordinates": []}},
+                "compute_time_ms": round(compute_time_ms, 2),
+                "algorithm": "Dijkstra (Ponderado)" + (" con Amenazas Simuladas" if simulate_failures else ""),
+                "simulated_threats": []
+            }
 
         # Route 3: A* with probability-weighted cost
-        if algorithm == 'all' or algorithm == 'astar_prob':
-            try:
-                start_time = time.time()
-                # A* with slightly different cost function (emphasizes distance more)
-                penalty_clause = f"(CASE WHEN w.id IN ({ids_str}) THEN w.cost_combined * 10 ELSE w.cost_combined END) * 0.8 + w.length_m * 0.2" if ids_str else "w.cost_combined * 0.8 + w.length_m * 0.2"
-                sql_for_pgr = f"""
-                    SELECT w.id, w.source, w.target,
-                           {penalty_clause} as cost,
-                           ST_X(sv.the_geom) as x1, ST_Y(sv.the_geom) as y1,
-                           ST_X(tv.the_geom) as x2, ST_Y(tv.the_geom) as y2
-                    FROM rr.ways w
-                    JOIN rr.ways_vertices_pgr sv ON w.source = sv.id
-                    JOIN rr.ways_vertices_pgr tv ON w.target = tv.id
-                    WHERE w.cost_combined > 0
-                """
-                route_query = "SELECT seq, path_seq, node, edge, cost, agg_cost FROM pgr_astar(%s, %s, %s, directed := false)"
-                params = (sql_for_pgr, source_node, target_node)
-
-                app.logger.info(f"Route query: {route_query}")
-                geojson = build_route_geojson(cur, route_query, params, start_lng, start_lat, end_lng, end_lat)
-                compute_time_ms = (time.time() - start_time) * 1000
-
-                results['astar_prob'] = {
-                    "route_geojson": geojson or {"type": "Feature", "properties": {"total_length_m": 0, "total_cost": 0}, "geometry": {"type": "LineString", "coordinates": []}},
+        def route_astar_prob(cur):
+            start_time = time.perf_counter_ns()
+            # A* with slightly different cost function (emphasizes distance more)
+            params = (EDGES_ASTAR_SQL, source_node, target_node)
+            geojson = build_route_geojson(cur, 'route_astar', params, start_lng, start_lat, end_lng, end_lat)
+            compute_time_ms = (time.perf_counter_ns() - start_time) / 1e6
+
+            return {
+                "route_geojson": geojson or {"type": "Feature", "properties": {"total_length_m": 0, "total_cost": 0}, "geometry": {"type": "LineString", "coordinates": []}},
+                "compute_time_ms": round(compute_time_ms, 2),
+                "algorithm": "A* (Ponderado)" + (" con Amenazas Simuladas" if simulate_failures else ""),
+                "simulated_threats": []
+            }
+
+        # Route 4: CPLEX-like optimization (risk-constrained shortest path)
+        def route_cplex(cur):
+            start_time = time.perf_counter_ns()
+
+            # CPLEX approximation: use cost that heavily penalizes high-risk edges
+            # Instead of excluding high-risk edges, make them very expensive
+            params = (EDGES_RISK_SQL, source_node, target_node)
+            geojson = build_route_geojson(cur, 'route_dijkstra', params, start_lng, start_lat, end_lng, end_lat)
+            compute_time_ms = (time.perf_counter_ns() - start_time) / 1e6
+
+            # Check if route has actual coordinates (not empty)
+            has_valid_route = (geojson and geojson.get('geometry', {}).get('coordinates') and
+                             len(geojson['geometry']['coordinates']) > 0)
+
+            if has_valid_route:
+                return {
+                    "route_geojson": geojson,
                     "compute_time_ms": round(compute_time_ms, 2),
-                    "algorithm": "A* (Ponderado)" + (" con Amenazas Simuladas" if simulate_failures else ""),
+                    "algorithm": "CPLEX (Optimizado con Penalización de Riesgo)" + (" con Amenazas Simuladas" if simulate_failures else ""),
                     "simulated_threats": []
                 }
-            except Exception as e:
-                app.logger.error(f"Error calculating astar_prob route: {str(e)}")
+            else:
+                # Fallback: use standard weighted dijkstra
+                params = (EDGES_WEIGHTED_SQL, source_node, target_node)
+                geojson = build_route_geojson(cur, 'route_dijkstra', params, start_lng, start_lat, end_lng, end_lat)
+                if geojson and geojson.get('geometry', {}).get('coordinates') and len(geojson['geometry']['coordinates']) > 0:
 
-        # Route 4: CPLEX-like optimization (risk-constrained shortest path)
-        if algorithm == 'all' or algorithm == 'cplex':
-            try:
-                start_time = time.time()
-
-                # CPLEX approximation: use cost that heavily penalizes high-risk edges
-                # Instead of excluding high-risk edges, make them very expensive
-                threat_penalty = f" * (CASE WHEN w.id IN ({ids_str}) THEN 10 ELSE 1 END)" if ids_str else ""
-                sql_for_pgr = f"""
-                    SELECT w.id, w.source, w.target,
-                           w.cost_combined * (1 + COALESCE(w.fail_prob, 0) * 10){threat_penalty} as cost
-                    FROM rr.ways w
-                    WHERE w.cost_combined > 0
-                """
-                route_query = "SELECT seq, path_seq, node, edge, cost, agg_cost FROM pgr_dijkstra(%s, %s, %s, directed := false)"
-                params = (sql_for_pgr, source_node, target_node)
-
-                geojson = build_route_geojson(cur, route_query, params, start_lng, start_lat, end_lng, end_lat)
-                compute_time_ms = (time.time() - start_time) * 1000
-
-                # Check if route has actual coordinates (not empty)
-                has_valid_route = (geojson and geojson.get('geometry', {}).get('coordinates') and
-                                 len(geojson['geometry']['coordinates']) > 0)
-
-                if has_valid_route:
-                    results['cplex'] = {
+                    return {
                         "route_geojson": geojson,
                         "compute_time_ms": round(compute_time_ms, 2),
-                        "algorithm": "CPLEX (Optimizado con Penalización de Riesgo)" + (" con Amenazas Simuladas" if simulate_failures else ""),
+                        "algorithm": "CPLEX (Fallback: Ponderado)" + (" con Amenazas Simuladas" if simulate_failures else ""),
                         "simulated_threats": []
                     }
-                else:
-                    # Fallback: use standard weighted dijkstra
-                    penalty_clause = f"CASE WHEN w.id IN ({ids_str}) THEN w.cost_combined * 10 ELSE w.cost_combined END" if ids_str else "w.cost_combined"
-                    sql_for_pgr = f"SELECT w.id, w.source, w.target, {penalty_clause} as cost FROM rr.ways w WHERE w.cost_combined > 0"
-                    route_query = "SELECT seq, path_seq, node, edge, cost, agg_cost FROM pgr_dijkstra(%s, %s, %s, directed := false)"
-                    params = (sql_for_pgr, source_node, target_node)
-                    geojson = build_route_geojson(cur, route_query, params, start_lng, start_lat, end_lng, end_lat)
-                    if geojson and geojson.get('geometry', {}).get('coordinates') and len(geojson['geometry']['coordinates']) > 0:
-
-                        results['cplex'] = {
-                            "route_geojson": geojson,
-                            "compute_time_ms": round(compute_time_ms, 2),
-                            "algorithm": "CPLEX (Fallback: Ponderado)" + (" con Amenazas Simuladas" if simulate_failures else ""),
-                            "simulated_threats": []
-                        }
-            except Exception as e:
-                app.logger.error(f"Error calculating cplex route: {str(e)}")
+
+        route_variants = [
+            ('dijkstra_dist', route_dijkstra_dist),
+            ('dijkstra_prob', route_dijkstra_prob),
+            ('astar_prob', route_astar_prob),
+            ('cplex', route_cplex),
+        ]
+        route_variants = [(name, fn) for name, fn in route_variants if algorithm in ('all', name)]
+        no_route = {
+            "error": "No se pudo calcular ninguna ruta entre los puntos especificados",
+            "details": "Puede que los puntos no estén conectados en la red o no haya rutas disponibles"
+        }
+
+        if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson':
+            # Like /api/threats, the stream outlives the app context: the response
+            # takes the connection off g and returns it to the pool when closed.
+            conn = g.pop('db')
+
+            def release():
+                cur.close()
+                release_db_connection(conn)
+
+            def generate():
+                def line(obj):
+                    return orjson.dumps(obj, default=OrjsonProvider._default) + b'\n'
+                found = False
+                try:
+                    for name, result in iter_cached_route_variants(source_node, target_node, bool(simulate_failures), cur, route_variants):
+                        if result:
+                            found = True
+                            yield line({name: result})
+                    if not found:
+                        yield line(no_route)
+                    elif simulate_failures and simulated_threats:
+                        yield line({"simulated_threats": simulated_threats})
+                except Exception as e:
+                    # The 200 is already sent: report it in-band, as the client reads lines
+                    app.logger.error(f"Error streaming routes: {str(e)}")
+                    yield line({
+                        "error": "No se pudo calcular la ruta",
+                        "details": "Error inesperado. Revisa los logs del servidor para más información."
+                    })
+
+            resp = app.response_class(generate(), mimetype='application/x-ndjson')
+            resp.call_on_close(release)
+            return resp
+
+        results = cached_route_variants(source_node, target_node, bool(simulate_failures), cur, route_variants)
         
         cur.close()
-        conn.close()
         
         if not results:
-            return jsonify({
-                "error": "No se pudo calcular ninguna ruta entre los puntos especificados",
-                "details": "Puede que los puntos no estén conectados en la red o no haya rutas disponibles"
-            }), 404
+            return jsonify(no_route), 404
         
         # Add global simulated threats if requested
         if simulate_failures and simulated_threats:
@@ -997,4 +1295,6 @@ if __name__ == '__main__':
     # Debug mode should be disabled in production
     # Set via environment variable: export FLASK_DEBUG=1 for development
     debug_mode = os.getenv('FLASK_DEBUG', '0') == '1'
-    app.run(debug=debug_mode, host='0.0.0.0', port=5001)
+    # Development server only (threaded: concurrent requests share the DB pool).
+    # Production: gunicorn app:app -c gunicorn_conf.py (see README_WEB.md).
+    app.run(debug=debug_mode, host='0.0.0.0', port=5001, threaded=True)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn settings for serving app.py in production:
+  gunicorn app:app -c gunicorn_conf.py
+Env:
+  WEB_WORKERS (processes, default 2)
+  WEB_THREADS (threads per process, default 8; each process has its own DB pool, DB_POOL_MAX)
+  WEB_WORKER_CLASS (gthread by default; gevent needs `pip install gevent psycogreen`)
+  WEB_WORKER_CONNECTIONS (concurrent requests per gevent worker, default 500)
+  WEB_BIND (default 0.0.0.0:5001)
+"""
+import os
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
+workers = int(os.getenv("WEB_WORKERS", "2"))
+threads = int(os.getenv("WEB_THREADS", "8"))
+# Requests mostly wait on PostgreSQL: threads share one connection pool per worker
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+# gevent: many greenlets per worker; the ones beyond DB_POOL_MAX queue for a connection
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", "500"))
+bind = os.getenv("WEB_BIND", "0.0.0.0:5001")
+# /api/threats streams large FeatureCollections; don't cut slow clients at 30 s
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+keepalive = 5
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # psycopg2 blocks in C; under gevent make its waits yield to other greenlets
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -68,7 +68,8 @@ def main():
                   subtype  = EXCLUDED.subtype,
                   severity = EXCLUDED.severity,
                   props    = EXCLUDED.props,
-                  geom     = EXCLUDED.geom;
+                  geom     = EXCLUDED.geom,
+                  updated_at = NOW();
             """, rows,
             template="(%s,%s,%s,%s,%s, ST_SetSRID(ST_GeomFromGeoJSON(%s),4326))",
             page_size=1000)
@@ -2,10 +2,10 @@
 # -*- coding: utf-8 -*-
 """
 Loader amenazas clima (OpenWeather) con deduplicación por ext_id.
-Entrada: amenazas/weather_threats.geojson (Polygon features; props.ext_id)
+Entrada: amenazas/weather_threats.geojson o .geojson.gz (Polygon features; props.ext_id)
 Tabla: rr.amenazas_clima(ext_id PK, kind, subtype, severity, props jsonb, geom)
 """
-import os, json
+import os, json, gzip
 from pathlib import Path
 import psycopg2
 from psycopg2.extras import execute_values, Json
@@ -21,23 +21,27 @@ PGPASSWORD=os.getenv("PGPASSWORD","postgres")
 
 ROOT=Path(__file__).resolve().parents[1]
 GJ=ROOT/"amenazas"/"weather_threats.geojson"
+GJ_GZ=GJ.with_name(GJ.name+".gz")
 
 def main():
-    if not GJ.exists():
-        print(f"[WARN] {GJ} no existe. Ejecuta primero weather_openweather_parallel.py")
+    # El extractor escribe .geojson.gz con WEATHER_GZIP=true; usar el más reciente
+    path=GJ_GZ if GJ_GZ.exists() and (not GJ.exists() or GJ_GZ.stat().st_mtime > GJ.stat().st_mtime) else GJ
+    if not path.exists():
+        print(f"[WARN] {path} no existe. Ejecuta primero weather_openweather_parallel.py")
         print("[INFO] No se cargaron amenazas de clima.")
         return
     
     try:
-        gj=json.loads(GJ.read_text(encoding="utf-8"))
+        raw=path.read_bytes()
+        gj=json.loads(gzip.decompress(raw) if path.suffix==".gz" else raw)
     except Exception as e:
-        print(f"[ERROR] No se pudo leer {GJ}: {e}")
+        print(f"[ERROR] No se pudo leer {path}: {e}")
         return
     
     feats=gj.get("features") or []
     
     if len(feats) == 0:
-        print(f"[WARN] {GJ} no contiene amenazas.")
+        print(f"[WARN] {path} no contiene amenazas.")
         print("[INFO] Puede ser que la API de OpenWeather aún no esté activada o que no haya condiciones climáticas severas.")
         return
 
@@ -71,7 +75,8 @@ def main():
                   subtype  = EXCLUDED.subtype,
                   severity = EXCLUDED.severity,
                   props    = EXCLUDED.props,
-                  geom     = EXCLUDED.geom;
+                  geom     = EXCLUDED.geom,
+                  updated_at = NOW();
             """, rows,
             template="(%s,%s,%s,%s,%s, ST_SetSRID(ST_GeomFromGeoJSON(%s),4326))",
             page_size=1000)
@@ -124,7 +124,8 @@ CREATE TABLE IF NOT EXISTS rr.amenazas_waze (
   severity  INTEGER,                        -- 0..N (heurística del loader)
   props     JSONB,                          -- objeto crudo enriquecido
   geom      geometry(Geometry, 4326) NOT NULL, -- Point o LineString
-  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()  -- lo tocan los loaders en cada upsert (ETag de /api/threats)
 );
 CREATE INDEX IF NOT EXISTS am_waze_geom_gix ON rr.amenazas_waze USING GIST (geom);
 CREATE INDEX IF NOT EXISTS am_waze_gin      ON rr.amenazas_waze USING GIN (props);
@@ -137,7 +138,8 @@ CREATE TABLE IF NOT EXISTS rr.amenazas_calming (
   severity  INTEGER,                        -- típica = 1
   props     JSONB,
   geom      geometry(Point, 4326) NOT NULL,
-  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()  -- lo tocan los loaders en cada upsert (ETag de /api/threats)
 );
 CREATE INDEX IF NOT EXISTS am_calming_geom_gix ON rr.amenazas_calming USING GIST (geom);
 CREATE INDEX IF NOT EXISTS am_calming_gin      ON rr.amenazas_calming USING GIN (props);
@@ -150,7 +152,8 @@ CREATE TABLE IF NOT EXISTS rr.amenazas_clima (
   severity  INTEGER,                        -- 0..N (según umbrales)
   props     JSONB,                          -- incluye metrics: rain_mm_h, wind_ms, ts, etc.
   geom      geometry(Polygon, 4326) NOT NULL, -- celda cubierta
-  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()  -- lo tocan los loaders en cada upsert (ETag de /api/threats)
 );
 CREATE INDEX IF NOT EXISTS am_clima_geom_gix ON rr.amenazas_clima USING GIST (geom);
 CREATE INDEX IF NOT EXISTS am_clima_gin      ON rr.amenazas_clima USING GIN (props);
@@ -165,7 +168,8 @@ CREATE TABLE IF NOT EXISTS rr.amenazas_calming (
   severity  INTEGER,                        -- típica = 1
   props     JSONB,
   geom      geometry(Point, 4326) NOT NULL,
-  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()  -- lo tocan los loaders en cada upsert (ETag de /api/threats)
 );
 CREATE INDEX IF NOT EXISTS am_calming_geom_gix ON rr.amenazas_calming USING GIST (geom);
 CREATE INDEX IF NOT EXISTS am_calming_gin      ON rr.amenazas_calming USING GIN (props);
@@ -178,11 +182,17 @@ CREATE TABLE IF NOT EXISTS rr.amenazas_clima (
   severity  INTEGER,                        -- 0..N (según umbrales)
   props     JSONB,                          -- incluye metrics: rain_mm_h, wind_ms, ts, etc.
   geom      geometry(Polygon, 4326) NOT NULL, -- celda cubierta
-  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()  -- lo tocan los loaders en cada upsert (ETag de /api/threats)
 );
 CREATE INDEX IF NOT EXISTS am_clima_geom_gix ON rr.amenazas_clima USING GIST (geom);
 CREATE INDEX IF NOT EXISTS am_clima_gin      ON rr.amenazas_clima USING GIN (props);
 
+-- Bases creadas antes de updated_at
+ALTER TABLE rr.amenazas_waze    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE rr.amenazas_calming ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+ALTER TABLE rr.amenazas_clima   ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
 -- =========================================================
 -- 6) Sugerencias de integridad / utilidades
 -- =========================================================
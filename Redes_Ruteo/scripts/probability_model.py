@@ -8,7 +8,7 @@ Calculates failure probabilities for network elements based on threat proximity.
 import os
 import sys
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
 import time
 
@@ -388,6 +388,12 @@ def calculate_failure_probabilities(conn):
         
         # Reset probabilities first
         cur.execute("UPDATE rr.ways SET fail_prob = 0.0")
+        # Highest probability per way over all threats, written in one UPDATE at the end
+        way_probs = {}
+
+        def keep_max(way_id, prob):
+            if prob > way_probs.get(way_id, 0.0):
+                way_probs[way_id] = prob
         
         # Process Waze threats
         if waze_count > 0:
@@ -400,10 +406,8 @@ def calculate_failure_probabilities(conn):
                 JOIN rr.amenazas_waze t ON ST_DWithin(w.geom, t.geom, %(radius_deg)s)
             """, {'radius_deg': meters_to_degrees(get_influence_radius('waze'))})
             
-            waze_results = cur.fetchall()
-            for row in waze_results:
-                prob = calculate_dynamic_probability('waze', row['severity'], row['distance_m'], row['size_m'], 0.8)
-                cur.execute("UPDATE rr.ways SET fail_prob = GREATEST(fail_prob, %s) WHERE id = %s", (prob, row['way_id']))
+            for row in cur.fetchall():
+                keep_max(row['way_id'], calculate_dynamic_probability('waze', row['severity'], row['distance_m'], row['size_m'], 0.8))
         
         # Process Weather threats
         if weather_count > 0:
@@ -417,13 +421,11 @@ def calculate_failure_probabilities(conn):
                 JOIN rr.amenazas_clima t ON ST_Intersects(w.geom, t.geom)
             """)
             
-            weather_results = cur.fetchall()
-            for row in weather_results:
+            for row in cur.fetchall():
                 # Estimate size from area
                 size_m = (row['area_km2'] * 1000000) ** 0.5  # Square root of area as rough diameter
                 visibility_factor = 1.5 if row['severity'] >= 4 else 1.0  # Higher for low visibility
-                prob = calculate_dynamic_weather_probability(row['severity'], row['distance_m'], size_m, visibility_factor)
-                cur.execute("UPDATE rr.ways SET fail_prob = GREATEST(fail_prob, %s) WHERE id = %s", (prob, row['way_id']))
+                keep_max(row['way_id'], calculate_dynamic_weather_probability(row['severity'], row['distance_m'], size_m, visibility_factor))
         
         # Process Traffic Calming threats
         if calming_count > 0:
@@ -436,12 +438,16 @@ def calculate_failure_probabilities(conn):
                 JOIN rr.amenazas_calming t ON ST_DWithin(w.geom, t.geom, %(radius_deg)s)
             """, {'radius_deg': meters_to_degrees(get_influence_radius('calming'))})
             
-            calming_results = cur.fetchall()
-            for row in calming_results:
-                prob = calculate_dynamic_probability('calming', row['severity'], row['distance_m'], row['size_m'], 1.0)
-                cur.execute("UPDATE rr.ways SET fail_prob = GREATEST(fail_prob, %s) WHERE id = %s", (prob, row['way_id']))
+            for row in cur.fetchall():
+                keep_max(row['way_id'], calculate_dynamic_probability('calming', row['severity'], row['distance_m'], row['size_m'], 1.0))
         
-        ways_affected = cur.rowcount
+        # One statement instead of one UPDATE round trip per (way, threat) pair
+        execute_values(cur, """
+            UPDATE rr.ways w SET fail_prob = v.prob
+            FROM (VALUES %s) AS v(id, prob)
+            WHERE w.id = v.id
+        """, list(way_probs.items()), template="(%s::bigint, %s::float8)", page_size=5000)
+        ways_affected = len(way_probs)
         print(f"✓ Updated ways with dynamic probabilities in {time.time()-start_all:.1f}s")
 
         # Update vertices within influence radius of threats (if table exists)
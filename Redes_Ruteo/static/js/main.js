@@ -431,11 +431,13 @@ function calculateRoute() {
     // Check if simulation is requested
     const simulateFailures = document.getElementById('simulate-failures').checked;
 
-    // Call API for all algorithms
+    // Call API for all algorithms; routes arrive as NDJSON lines, each one is
+    // drawn as soon as the server has it instead of after the slowest one
     fetch('/api/calculate_route', {
         method: 'POST',
         headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Accept': 'application/x-ndjson'
         },
         body: JSON.stringify({
             start: { lat: startLatLng.lat, lng: startLatLng.lng },
@@ -456,9 +458,7 @@ function calculateRoute() {
                 throw err;
             });
         }
-        return response.json();
-    })
-    .then(data => {
+        
         // Clear previous routes
         Object.keys(routeLayers).forEach(key => {
             if (routeLayers[key]) {
@@ -467,84 +467,128 @@ function calculateRoute() {
             }
         });
         
-        // Draw each route on map with different colors
-        let allBounds = [];
-        Object.keys(data).forEach(algorithmKey => {
-            const routeData = data[algorithmKey];
-            if (routeData && routeData.route_geojson && routeData.route_geojson.geometry && routeData.route_geojson.geometry.coordinates && routeData.route_geojson.geometry.coordinates.length > 0) {
-                const checkbox = document.getElementById(`show-${algorithmKey.replace(/_/g, '-')}`);
-                const isVisible = checkbox ? checkbox.checked : true;
-                
-                const layer = L.geoJSON(routeData.route_geojson, {
-                    style: {
-                        color: routeColors[algorithmKey],
-                        weight: 4,
-                        opacity: isVisible ? 0.7 : 0
-                    }
-                });
-                
-                if (isVisible) {
-                    layer.addTo(map);
-                    // Only add bounds for visible routes
-                    const bounds = layer.getBounds();
-                    if (bounds.isValid()) {
-                        allBounds.push(bounds);
-                    }
+        const data = {};
+        return readNdjson(response, item => {
+            if (item.error) {
+                throw new Error(item.error);
+            }
+            Object.keys(item).forEach(algorithmKey => {
+                if (algorithmKey === 'simulated_threats') {
+                    return;
                 }
-                
-                routeLayers[algorithmKey] = layer;
+                data[algorithmKey] = item[algorithmKey];
+                drawRoute(algorithmKey, item[algorithmKey]);
+            });
+            showRouteInfo(data);
+        });
+    })
+    .then(() => {
+        fitToVisibleRoutes();
+        console.log('Routes calculated successfully');
+    })
+    .catch(error => {
+        console.error('Error calculating routes:', error);
+        routeInfo.innerHTML = `<p style="color: red;"><strong>Error:</strong> ${error.message}</p>`;
+    });
+}
+
+// Call onItem with each JSON line of a streamed application/x-ndjson response
+function readNdjson(response, onItem) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    function pump() {
+        return reader.read().then(({ done, value }) => {
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split('\n');
+            buffer = done ? '' : lines.pop();
+            lines.filter(line => line.trim()).forEach(line => onItem(JSON.parse(line)));
+            return done ? undefined : pump();
+        });
+    }
+    return pump();
+}
+
+// Draw one calculated route on the map with its algorithm color
+function drawRoute(algorithmKey, routeData) {
+    if (routeData && routeData.route_geojson && routeData.route_geojson.geometry && routeData.route_geojson.geometry.coordinates && routeData.route_geojson.geometry.coordinates.length > 0) {
+        const checkbox = document.getElementById(`show-${algorithmKey.replace(/_/g, '-')}`);
+        const isVisible = checkbox ? checkbox.checked : true;
+        
+        const layer = L.geoJSON(routeData.route_geojson, {
+            style: {
+                color: routeColors[algorithmKey],
+                weight: 4,
+                opacity: isVisible ? 0.7 : 0
             }
         });
         
-        // Fit map to visible routes if we have valid bounds
-        if (allBounds.length > 0) {
-            try {
-                const combinedBounds = allBounds.reduce((acc, bounds) => acc.extend(bounds), allBounds[0]);
-                if (combinedBounds.isValid()) {
-                    map.fitBounds(combinedBounds, { padding: [50, 50] });
-                }
-            } catch (error) {
-                console.warn('Could not fit map bounds:', error);
+        if (isVisible) {
+            layer.addTo(map);
+        }
+        
+        routeLayers[algorithmKey] = layer;
+    }
+}
+
+// Fit map to visible routes, or to the start and end markers when there is none
+function fitToVisibleRoutes() {
+    let allBounds = [];
+    Object.keys(routeLayers).forEach(algorithmKey => {
+        const layer = routeLayers[algorithmKey];
+        // Only add bounds for visible routes
+        if (layer && map.hasLayer(layer)) {
+            const bounds = layer.getBounds();
+            if (bounds.isValid()) {
+                allBounds.push(bounds);
             }
-        } else {
-            // If no valid routes, fit to start and end markers
-            if (startMarker && endMarker) {
-                const markerBounds = L.latLngBounds([startMarker.getLatLng(), endMarker.getLatLng()]);
-                map.fitBounds(markerBounds, { padding: [50, 50] });
+        }
+    });
+    
+    if (allBounds.length > 0) {
+        try {
+            const combinedBounds = allBounds.reduce((acc, bounds) => acc.extend(bounds), allBounds[0]);
+            if (combinedBounds.isValid()) {
+                map.fitBounds(combinedBounds, { padding: [50, 50] });
             }
+        } catch (error) {
+            console.warn('Could not fit map bounds:', error);
         }
-        
-        // Display route info only for selected algorithms
-        let routeInfoHtml = '<h4>Resultados de Ruteo</h4>';
-        
-        Object.keys(data).forEach(algorithmKey => {
-            const routeData = data[algorithmKey];
-            if (routeData && routeData.route_geojson) {
-                const checkbox = document.getElementById(`show-${algorithmKey.replace(/_/g, '-')}`);
-                const isVisible = checkbox ? checkbox.checked : true;
+    } else {
+        // If no valid routes, fit to start and end markers
+        if (startMarker && endMarker) {
+            const markerBounds = L.latLngBounds([startMarker.getLatLng(), endMarker.getLatLng()]);
+            map.fitBounds(markerBounds, { padding: [50, 50] });
+        }
+    }
+}
+
+// Display route info only for selected algorithms
+function showRouteInfo(data) {
+    let routeInfoHtml = '<h4>Resultados de Ruteo</h4>';
+    
+    Object.keys(data).forEach(algorithmKey => {
+        const routeData = data[algorithmKey];
+        if (routeData && routeData.route_geojson) {
+            const checkbox = document.getElementById(`show-${algorithmKey.replace(/_/g, '-')}`);
+            const isVisible = checkbox ? checkbox.checked : true;
+            
+            if (isVisible) {
+                const lengthKm = (routeData.route_geojson.properties.total_length_m / 1000).toFixed(2);
+                const color = routeColors[algorithmKey];
                 
-                if (isVisible) {
-                    const lengthKm = (routeData.route_geojson.properties.total_length_m / 1000).toFixed(2);
-                    const color = routeColors[algorithmKey];
-                    
-                    routeInfoHtml += `
-                        <div class="route-metric">
-                            <span class="metric-label" style="color: ${color}">⬤ ${routeData.algorithm}:</span>
-                            <span class="metric-value">${lengthKm} km (${routeData.compute_time_ms.toFixed(2)} ms)</span>
-                        </div>
-                    `;
-                }
+                routeInfoHtml += `
+                    <div class="route-metric">
+                        <span class="metric-label" style="color: ${color}">⬤ ${routeData.algorithm}:</span>
+                        <span class="metric-value">${lengthKm} km (${routeData.cached ? 'en caché, ' : ''}${routeData.compute_time_ms.toFixed(2)} ms)</span>
+                    </div>
+                `;
             }
-        });
-        
-        routeInfo.innerHTML = routeInfoHtml;
-        
-        console.log('Routes calculated successfully');
-    })
-    .catch(error => {
-        console.error('Error calculating routes:', error);
-        routeInfo.innerHTML = `<p style="color: red;"><strong>Error:</strong> ${error.message}</p>`;
+        }
     });
+    
+    document.getElementById('route-info').innerHTML = routeInfoHtml;
 }
 
 // Clear route and markers
@@ -0,0 +1,99 @@
+"""
+/api/threats hands its pooled connection to the streamed response; these checks
+run it against a fake pool (no PostgreSQL needed) and make sure the connection
+and its _db_slots permit always come back.
+"""
+import threading
+
+import pytest
+
+import app as app_module
+
+
+class FakeCursor:
+    def __init__(self, rows, fail=False):
+        self.rows = list(rows)
+        self.fail = fail
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        if not self.rows and self.fail:
+            raise RuntimeError("connection lost")
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    initialized = True
+    closed = 0
+
+    def __init__(self, rows, fail=False):
+        self.rows = rows
+        self.fail = fail
+        self.cursors = []
+
+    def cursor(self, *args, **kwargs):
+        self.cursors.append(FakeCursor(self.rows, self.fail))
+        return self.cursors[-1]
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.out = 0
+
+    def getconn(self):
+        self.out += 1
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.out -= 1
+
+
+def make_client(monkeypatch, rows, fail=False):
+    pool = FakePool(FakeConnection(rows, fail))
+    monkeypatch.setattr(app_module, '_db_pool', pool)
+    monkeypatch.setattr(app_module, '_db_slots', threading.BoundedSemaphore(app_module.DB_POOL_MAX))
+    monkeypatch.setattr(app_module, 'ensure_schema', lambda conn: None)
+    monkeypatch.setattr(app_module, 'threats_version', lambda conn: 'v1')
+    monkeypatch.setattr(app_module, 'THREATS_CACHE_TTL', 0)
+    return app_module.app.test_client(), pool
+
+
+FEATURE = '{"type":"Feature","properties":{},"geometry":null}'
+
+
+def test_head_releases_connection(monkeypatch):
+    client, pool = make_client(monkeypatch, [(FEATURE,)] * 3)
+    for _ in range(3):
+        resp = client.head('/api/threats')
+        assert resp.status_code == 200
+        resp.close()
+    assert pool.out == 0
+    assert app_module._db_slots._value == app_module.DB_POOL_MAX
+    assert all(cur.closed for cur in pool.conn.cursors)
+
+
+def test_get_streams_and_releases_connection(monkeypatch):
+    client, pool = make_client(monkeypatch, [(FEATURE,)] * 3)
+    resp = client.get('/api/threats')
+    assert resp.get_json()['features'] == [{"type": "Feature", "properties": {}, "geometry": None}] * 3
+    resp.close()
+    assert pool.out == 0
+    assert app_module._db_slots._value == app_module.DB_POOL_MAX
+
+
+def test_stream_error_aborts_instead_of_ending_cleanly(monkeypatch):
+    client, pool = make_client(monkeypatch, [(FEATURE,)] * 3, fail=True)
+    resp = client.get('/api/threats', buffered=False)
+    with pytest.raises(RuntimeError):
+        b''.join(resp.response)
+    resp.close()
+    assert pool.out == 0
+    assert app_module._db_slots._value == app_module.DB_POOL_MAX